@@ -1,5 +1,8 @@
 from gym.envs.registration import register
-from .envs import IronInterfEnv
+from .envs import IronInterfEnv, IronInterfSimEnv
 
 register(id='iron_interf-v2',
          entry_point='iron_interf.envs:IronInterfEnv')
+
+register(id='iron_interf_sim-v2',
+         entry_point='iron_interf.envs:IronInterfSimEnv')
@@ -1 +1,3 @@
 from iron_interf.envs.iron_interf_env import IronInterfEnv
+from iron_interf.envs.iron_interf_sim_env import IronInterfSimEnv
+from iron_interf.envs.iron_interf_batch_sim import IronInterfBatchSim
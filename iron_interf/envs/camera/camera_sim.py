@@ -0,0 +1,234 @@
+from threading import Thread
+import time
+
+import numpy as np
+
+
+class SimModulation(object):
+    """
+    piezo modulation shared by the simulated camera and photodiode,
+    the fringe phase follows the generator sine and sweeps 2 pi in every half period
+    """
+    def __init__(self, period=1., visibility=0.5, generator_offset=500., generator_amplitude=400.,
+                 detector_amplitude=300., dark=50., noise=2.):
+        self.period = period
+        self.visibility = visibility
+        self.generator_offset = generator_offset
+        self.generator_amplitude = generator_amplitude
+        self.detector_amplitude = detector_amplitude
+        self.dark = dark
+        self.noise = noise
+        self.start_time = time.time()
+        self.rng = np.random.default_rng()
+
+    def _generator_phase(self, t):
+        return 2 * np.pi * (t - self.start_time) / self.period
+
+    def generator(self, t):
+        return self.generator_offset + self.generator_amplitude * np.sin(self._generator_phase(t))
+
+    def fringe_phase(self, t):
+        return np.pi * (1 + np.sin(self._generator_phase(t)))
+
+    def detector(self, t):
+        intens = self.detector_amplitude * (1 + self.visibility * np.cos(self.fringe_phase(t)))
+        return self.dark + intens + self.noise * self.rng.standard_normal(np.shape(t))
+
+
+class SimSerialPortReader(object):
+    """
+    simulated SerialPortReader, samples are produced at sample_rate while the port is open
+    """
+    def __init__(self, modulation, sample_rate=360):
+        self.modulation = modulation
+        self.sample_rate = sample_rate
+        self.is_open = False
+        self._read_time = None
+
+    def get_data(self, verbose=False):
+        """
+        arduino convention: "value_generator, value_detector"
+        """
+        period = 1. / self.sample_rate
+        while True:
+            delay = self._read_time + period - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self._read_time += period
+            yield self.modulation.generator(self._read_time), self.modulation.detector(self._read_time)
+
+    def read_samples(self):
+        """
+        the samples produced since the last read, blocks until there is one
+        """
+        period = 1. / self.sample_rate
+        delay = self._read_time + period - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        n_samples = int((time.time() - self._read_time) / period)
+        times = self._read_time + period * np.arange(1, n_samples + 1)
+        self._read_time += n_samples * period
+        return np.stack([self.modulation.generator(times), self.modulation.detector(times)], axis=1)
+
+    def open(self):
+        self.is_open = True
+        self._read_time = time.time()
+
+    def close(self):
+        self.is_open = False
+
+    def flush(self):
+        self._read_time = time.time()
+
+
+class Rect(object):
+    def __init__(self, x=0, y=0, width=0, height=0):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+
+class SimImageData(object):
+    def __init__(self, array, timestamp=0., frame_number=0):
+        self.array = array
+        self.timestamp = timestamp
+        self.frame_number = frame_number
+
+    def as_1d_image(self):
+        return self.array
+
+    def get_info(self):
+        return self.timestamp, self.frame_number
+
+    def unlock(self):
+        pass
+
+
+class SimCamera(object):
+    """
+    simulated ueye Camera, films tilted fringes under a gaussian envelope modulated by SimModulation
+    """
+    def __init__(self, modulation, width=1024, height=768, fps_range=(1., 30.), n_fringes=0.5):
+        self.modulation = modulation
+        self.sensor_width = width
+        self.sensor_height = height
+        self.fps_range = fps_range
+        self.n_fringes = n_fringes
+        self.current_fps = None
+        self.exposure = 0.5
+        self.capturing = False
+        self.binning = 1
+        self.aoi = Rect(0, 0, width, height)
+        self._update_grid()
+
+    def _update_grid(self):
+        # sensor coordinates of the binned aoi pixel centers
+        y, x = np.mgrid[0:self.aoi.height, 0:self.aoi.width].astype(np.float32)
+        y = ((y + self.aoi.y + 0.5) * self.binning - self.sensor_height / 2) / self.sensor_height
+        x = ((x + self.aoi.x + 0.5) * self.binning - self.sensor_width / 2) / self.sensor_height
+        self._envelope = np.exp(-(x ** 2 + y ** 2) / (2 * 0.2 ** 2))
+        self._spatial_phase = 2 * np.pi * self.n_fringes * (x + y) / np.sqrt(2)
+
+    def handle(self):
+        return self
+
+    def init(self):
+        pass
+
+    def exit(self):
+        self.capturing = False
+
+    def alloc(self, buffer_count=3):
+        pass
+
+    def set_colormode(self, colormode):
+        pass
+
+    def get_aoi(self):
+        return Rect(self.aoi.x, self.aoi.y, self.aoi.width, self.aoi.height)
+
+    def set_aoi(self, x, y, width, height):
+        self.aoi = Rect(x, y, width, height)
+        self._update_grid()
+
+    def set_binning(self, factor):
+        # binned pixels average the sensor pixels
+        self.binning = factor
+        self.aoi = Rect(0, 0, self.sensor_width // factor, self.sensor_height // factor)
+        self._update_grid()
+        return True
+
+    def set_subsampling(self, factor):
+        return self.set_binning(factor)
+
+    def set_exposure(self, value):
+        self.exposure = value
+
+    def get_exposure(self):
+        return self.exposure
+
+    def capture_video(self, wait=False):
+        self.capturing = True
+
+    def stop_video(self):
+        self.capturing = False
+
+    def set_fps(self, fps):
+        self.current_fps = float(np.clip(fps, *self.fps_range))
+        return self.current_fps
+
+    def get_fps(self):
+        return self.current_fps
+
+    def get_fps_range(self):
+        return list(self.fps_range)
+
+    def capture(self, t):
+        # 0.5 ms exposure fills about half of the 8 bit range
+        intens = 120. * self.exposure / 0.5 * self._envelope
+        fringes = 1 + self.modulation.visibility * np.cos(self._spatial_phase + self.modulation.fringe_phase(t))
+        return np.clip(intens * fringes, 0, 255).astype(np.uint8)
+
+
+class SimFrameThread(Thread):
+    """
+    simulated FrameThread, notifies the views with a new frame at the camera fps
+    """
+    def __init__(self, cam, views=None, copy=True):
+        super(SimFrameThread, self).__init__()
+        self.timeout = 1000
+        self.cam = cam
+        self.running = True
+        self.views = views
+        self.copy = copy
+        self.frame_number = 0
+
+    def run(self):
+        next_time = time.time()
+        while self.running:
+            period = 1. / self.cam.get_fps()
+            next_time += period
+            delay = next_time - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -period:
+                # the camera does not wait for a late handler, the missed frames are dropped
+                missed = int(-delay / period)
+                next_time += missed * period
+                self.frame_number += missed
+            if self.cam.capturing:
+                t = time.time()
+                self.notify(SimImageData(self.cam.capture(t), t, self.frame_number))
+                self.frame_number += 1
+
+    def notify(self, image_data):
+        if self.views:
+            if type(self.views) is not list:
+                self.views = [self.views]
+            for view in self.views:
+                view.handle(image_data)
+
+    def stop(self):
+        self.cam.stop_video()
+        self.running = False
@@ -1,85 +1,343 @@
-from .pyueye_example_camera import Camera
-from .pyueye_example_utils import FrameThread
 import threading
 import time
-from .trigger import CameraTrigger
+from .trigger import CameraTrigger, SerialPortReader
+from ..visibility import modulation_phases, fit_modulation_interval
 
-from pyueye import ueye
-
-import cv2
 import numpy as np
 
 # TODO: run me as root once to start a daemon
 # /usr/bin/ueyeusbd
 
 
+def downsample_frames(images, height, width, crop=None, out=None):
+    """
+    crop, area downsample and sum a (n_frames, H, W) uint8 stack in one pass,
+    rows and columns that do not fill a whole block are dropped
+    :param crop: (rows, columns) slices applied to every frame
+    :param out: (n_frames, height, width) uint8 buffer for the downsampled frames
+    :return: downsampled frames and (n_frames,) total intensity
+    """
+    if crop is not None:
+        images = images[(slice(None),) + tuple(crop)]
+    n_frames, h, w = images.shape
+    block_h, block_w = h // height, w // width
+    assert block_h > 0 and block_w > 0, 'can not downsample {}x{} to {}x{}'.format(h, w, height, width)
+    images = images[:, :block_h * height, :block_w * width]
+
+    # whole rows are summed first, it is much faster than summing the small blocks
+    row_dtype = np.uint16 if block_h * 255 < 2 ** 16 else np.uint32
+    rows = images.reshape(n_frames, height, block_h, block_w * width).sum(axis=2, dtype=row_dtype)
+    blocks = rows.reshape(n_frames, height, width, block_w).sum(axis=3, dtype=np.uint32)
+    tot_intens = blocks.sum(axis=(1, 2), dtype=np.uint64)
+
+    if out is None:
+        out = np.empty((n_frames, height, width), dtype=np.uint8)
+    block_size = block_h * block_w
+    blocks += block_size // 2
+    np.floor_divide(blocks, block_size, out=out, casting='unsafe')
+    return out, tot_intens
+
+
+# per-frame reducers for IDSCamera.add_reducer
+def total_intensity(image):
+    return image.sum(dtype=np.uint64)
+
+
+def min_max(image):
+    return image.min(), image.max()
+
+
+def histogram(image):
+    return np.bincount(image.ravel(), minlength=256)
+
+
+def downsampler(height, width):
+    def downsample(image):
+        return downsample_frames(image[np.newaxis], height, width)[0][0]
+    return downsample
+
+
 class _ImageHandle(object):
-    def __init__(self, capacity=16):
-        self.images = []
-        self.last_image = None
-        self.is_started = False
+    """
+    frames are not copied, reducers run on every frame as it arrives, reading the driver
+    buffer directly, and their results are kept in a ring of ring_size slots, an acquisition
+    is the capacity frames written after start()
+
+    the results are ready as soon as the last frame lands, so are the driver timestamp,
+    the sequence number and the exposure of every frame
+
+    only the last frame is kept, its buffer stays locked until the next frame arrives
+    and it is copied when image() asks for it
+    """
+    def __init__(self, capacity=16, ring_size=None, crop=None):
+        """
+        :param crop: (rows, columns) slices cut from every frame, None to keep the whole frame
+        """
         self.capacity = capacity
+        self.crop = crop
+        # the acquisition stays valid until ring_size - capacity more frames arrive
+        self.ring_size = ring_size if ring_size is not None else 2 * capacity
+        self.last_data = None
+        self.write_index = 0
+        self.start_index = None
+        self.generation = 0
+        self.reducers = {}
+        self.reduced_values = {}
+        # frame metadata
+        self.exposure = 0.
+        self.timestamps = np.zeros(self.ring_size)
+        # host clock, to place the frames in the photodiode stream
+        self.arrival_times = np.zeros(self.ring_size)
+        self.sequence = np.zeros(self.ring_size, dtype=np.int64)
+        self.exposures = np.zeros(self.ring_size, dtype=np.float32)
+        self.dropped = 0
+        # guards the ring, notified on every new frame
+        self.condition = threading.Condition()
+
+    def add_reducer(self, name, reducer, shape=(), dtype=np.float64):
+        """
+        :param reducer: function of the cropped frame, called in the frame thread
+        :param shape: shape of the reducer result
+        a reducer added during an acquisition reads zeros for the frames that already arrived
+        """
+        with self.condition:
+            self.reducers[name] = reducer
+            self.reduced_values[name] = np.zeros((self.ring_size,) + tuple(shape), dtype=dtype)
 
     def handle(self, image_data):
         #print('handle image time', time.time())
-        self.last_image = image_data.as_1d_image()
-        self.last_image = self.last_image[:, 128: 1024 - 128]
-        if self.is_started and len(self.images) < self.capacity:
-            self.images.append(self.last_image)
-        image_data.unlock()
+        image = image_data.as_1d_image()
+        if self.crop is not None:
+            image = image[self.crop]
+        # the image may be a view of the driver buffer, it is released when the next frame replaces it
+        try:
+            arrival_time = time.time()
+            timestamp, frame_number = image_data.get_info()
+            reduced = {name: reducer(image) for name, reducer in self.reducers.items()}
+        except BaseException:
+            image_data.unlock()
+            raise
+        with self.condition:
+            previous, self.last_data = self.last_data, image_data
+            slot = self.write_index % self.ring_size
+            for name, value in reduced.items():
+                self.reduced_values[name][slot] = value
+            if self.write_index > 0:
+                last_frame_number = self.sequence[(self.write_index - 1) % self.ring_size]
+                self.dropped += max(frame_number - last_frame_number - 1, 0)
+            self.timestamps[slot] = timestamp
+            self.arrival_times[slot] = arrival_time
+            self.sequence[slot] = frame_number
+            self.exposures[slot] = self.exposure
+            self.write_index += 1
+            self.condition.notify_all()
+        # image() copies under the lock, so the replaced buffer is no longer read
+        if previous is not None:
+            previous.unlock()
+
+    def release(self):
+        """
+        unlocks the buffer of the last frame, to call once no more frames are handled
+        """
+        with self.condition:
+            previous, self.last_data = self.last_data, None
+        if previous is not None:
+            previous.unlock()
 
     def reset(self):
-        self.images = []
-        self.is_started = False
+        self.start_index = None
+
+    def is_ready(self, count=None):
+        count = self.capacity if count is None else count
+        return self.start_index is not None and self.write_index - self.start_index >= count
 
-    def is_ready(self):
-        # threading.Lock()
-        return len(self.images) >= self.capacity
+    def wait_ready(self, timeout=None, count=None):
+        """
+        :param count: wait for the first count frames of the acquisition only
+        :return: False if the acquisition is not complete after timeout seconds
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: self.is_ready(count), timeout)
 
     def start(self):
-        self.is_started = True
+        with self.condition:
+            self.start_index = self.write_index
+            self.generation += 1
 
-    def image(self):
-        # threading.Lock()
-        while self.last_image is None:
-            pass
-        return self.last_image
+    def _acquired(self, ring, count=None):
+        """
+        :param count: the first count frames of the acquisition, all of them by default
+        """
+        count = self.capacity if count is None else count
+        with self.condition:
+            first = self.start_index % self.ring_size
+            if first + count <= self.ring_size:
+                return ring[first: first + count]
+            return np.take(ring, range(first, first + count), axis=0, mode='wrap')
+
+    def reduced(self, name, count=None):
+        """
+        :return: the reducer results of the acquired frames, a view into the ring if they do not wrap around it
+        """
+        return self._acquired(self.reduced_values[name], count)
+
+    def metadata(self, count=None):
+        """
+        :return: copies of the timestamps, sequence numbers, exposures and arrival times of the acquired frames
+        """
+        return tuple(np.array(self._acquired(ring, count))
+                     for ring in (self.timestamps, self.sequence, self.exposures, self.arrival_times))
+
+    def dropped_frames(self, count=None):
+        """
+        :return: number of frames the camera sent during the acquisition that were not handled
+        """
+        sequence = self._acquired(self.sequence, count)
+        return int(sequence[-1] - sequence[0]) - (len(sequence) - 1)
+
+    def image(self, timeout=None):
+        """
+        :return: a copy of the last frame, cropped
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.last_data is not None, timeout):
+                raise TimeoutError('no frame from the camera in {} s'.format(timeout))
+            image = self.last_data.as_1d_image()
+            if self.crop is not None:
+                image = image[self.crop]
+            return np.array(image)
 
 
 class IDSCamera(object):
-    def __init__(self, n_frames, h_points, w_points):
-        self.image_handle = _ImageHandle(n_frames)
-        self.camera = Camera()
-        self.camera.init()
-        self.camera.set_colormode(ueye.IS_CM_SENSOR_RAW8)
+    # centered square of the 1024x768 sensor
+    software_crop = (slice(None), slice(128, 1024 - 128))
+    # seconds from the middle of the exposure to the frame arrival on the host,
+    # not measured yet on the bench, so "predict" sync is not the default
+    frame_latency = 0.
+    # seconds, the generator period, n_frames are filmed per period
+    modulation_period = 1.
+    # frames filmed before an adaptive capture can stop, the fit has 3 parameters
+    min_adaptive_frames = 6
+
+    def __init__(self, n_frames, h_points, w_points, simulated=False, capture_mode='software',
+                 n_buffers=4, zero_copy=True, sync='wait'):
+        """
+        :param capture_mode: "software" films the whole sensor and crops the frames on the host,
+            "sensor" programs the camera aoi and binning to send about h_points x w_points pixels
+        :param n_buffers: driver image buffers, the camera fills the others while a frame is handled
+        :param zero_copy: handle the frames as views of the driver buffers, they are unlocked
+            after the reducers, but for the last one, held until the next frame arrives
+        :param sync: "predict" films right away and orders the frames by the generator phase fitted
+            from the photodiode stream, "wait" films from the next generator max
+        """
+        assert sync in ('predict', 'wait'), 'unknown sync == {} options are "predict", "wait"'.format(sync)
+        self.sync = sync
+        assert capture_mode in ('software', 'sensor'), \
+            'unknown capture_mode == {} options are "software", "sensor"'.format(capture_mode)
+        crop = IDSCamera.software_crop if capture_mode == 'software' else None
+        self.image_handle = _ImageHandle(n_frames, crop=crop)
+        # the state is reduced while the frames arrive
+        self.image_handle.add_reducer('tot_intens', total_intensity, dtype=np.uint64)
+        self.image_handle.add_reducer('state', downsampler(h_points, w_points), (h_points, w_points), np.uint8)
+        if simulated:
+            from .camera_sim import SimModulation, SimCamera, SimFrameThread, SimSerialPortReader
+            modulation = SimModulation()
+            self.camera = SimCamera(modulation)
+            self.camera.init()
+            frame_thread, reader = SimFrameThread, SimSerialPortReader(modulation)
+            # the simulated bench does not share the calibration of the real one
+            trigger_args = {'calibration_path': None, 'calibration_time': 2 * modulation.period}
+        else:
+            from pyueye import ueye
+            from .pyueye_example_camera import Camera
+            from .pyueye_example_utils import FrameThread
+            self.camera = Camera()
+            self.camera.init()
+            self.camera.set_colormode(ueye.IS_CM_SENSOR_RAW8)
+            frame_thread, reader = FrameThread, SerialPortReader()
+            trigger_args = {}
+        if capture_mode == 'sensor':
+            # the aoi changes the frame timing, so it goes before set_fps
+            self._set_sensor_aoi(h_points, w_points)
         print('FPS range: ',self.camera.get_fps_range())
-        self.camera.set_fps(16)
+        self.camera.set_fps(n_frames / IDSCamera.modulation_period)
         print('Current FPS: ', self.camera.get_fps())
-        #self.camera.set_aoi(0, 0, h_points, w_points)
-        self.camera.alloc(1)
+        self.fps = float(self.camera.get_fps())
+        # twice the acquisition time
+        self.frame_timeout = 2 * n_frames / self.fps
+        self.camera.alloc(n_buffers)
         self.camera.capture_video()
-        self.thread = FrameThread(self.camera, self.image_handle)
+        self.thread = frame_thread(self.camera, self.image_handle, copy=not zero_copy)
         self.thread.timeout = 200
         self.thread.start()
-        self.camera.set_exposure(0.5)
-        self.trigger = CameraTrigger()
+        self.set_exposure(0.5)
+        self.trigger = CameraTrigger(reader=reader, **trigger_args)
         self.trigger.init()
 
         self.height = h_points
         self.width = w_points
+        # metadata of the last acquisition
+        self.frame_timestamps = None
+        self.frame_sequence = None
+        self.frame_exposures = None
+        self.dropped_frames = 0
+        self.captured_frames = 0
+        # visibility fitted to the frames when an adaptive capture stopped early, None otherwise
+        self.fitted_visibility = None
+        # acquired frame of every state frame
+        self.frame_order = None
+
+    def add_reducer(self, name, reducer, shape=(), dtype=np.float64):
+        """
+        runs reducer on every new frame, its results are read with image_handle.reduced(name)
+        :param reducer: function of the cropped frame, called in the frame thread
+        :param shape: shape of the reducer result
+        a reducer added during calc_state reads zeros for the frames that already arrived,
+        its results are complete from the next calc_state
+        """
+        self.image_handle.add_reducer(name, reducer, shape, dtype)
 
     def set_exposure(self, value):
         self.camera.set_exposure(value)
+        self.image_handle.exposure = value
+
+    def _set_sensor_aoi(self, h_points, w_points):
+        """
+        bin (or subsample) the sensor by the largest factor that keeps at least h_points x w_points,
+        then crop the centered square on the sensor
+        """
+        sensor = self.camera.get_aoi()
+        side = min(sensor.width, sensor.height)
+        for factor in (4, 2, 1):
+            if side // factor < max(h_points, w_points):
+                continue
+            if factor == 1 or self.camera.set_binning(factor) or self.camera.set_subsampling(factor):
+                break
+        side //= factor
+        self.camera.set_aoi((sensor.width // factor - side) // 2, (sensor.height // factor - side) // 2, side, side)
+        print('Sensor AOI: {}x{} binned by {}'.format(side, side, factor))
 
     def stop(self):
         self.thread.stop()
         self.thread.join()
+        self.image_handle.release()
         self.camera.stop_video()
         self.camera.exit()
+        self.trigger.close()
 
-    def calc_state(self, verbose=True):
+    def calc_state(self, verbose=True, out=None, read_device=True, tolerance=None):
+        '''
+        :param out: (n_frames, h_points, w_points) uint8 buffer for the state, allocated if None
+        :param read_device: False to return None instead of the photodiode samples
+        :param tolerance: stop filming once the visibility fitted to the frames is known within +- tolerance
+            and resample the frames to n_frames by fringe phase, None films one whole modulation period
+        :return: state, total intensity of every frame, photodiode samples,
+            the frame metadata follows the order of the state
+        '''
         begin_sync = time.time()
-        self.wait_for_start()
+        predicted = self.sync == 'predict' and self.trigger.tracker.fit()
+        if not predicted:
+            self.wait_for_start()
         end_sync = time.time()
         if verbose:
             print('SYNC_TIME', end_sync - begin_sync)
@@ -87,35 +345,104 @@ class IDSCamera(object):
         self.trigger.start()
         begin_film = time.time()
         self.image_handle.start()
-        while not self.image_handle.is_ready():
-            pass
-        images = np.array(self.image_handle.images)
+        count = self.image_handle.capacity
+        self.fitted_visibility = None
+        if tolerance is not None:
+            count = self._film_until_confident(tolerance, predicted)
+        elif not self.image_handle.wait_ready(self.frame_timeout):
+            raise TimeoutError('{} frames did not arrive in {} s'.format(self.image_handle.capacity, self.frame_timeout))
+        metadata = self.image_handle.metadata(count)
+        arrival_times = metadata[3]
+        if count < self.image_handle.capacity:
+            order = self._fringe_order(arrival_times, predicted)
+        elif predicted:
+            order = self._phase_order(arrival_times)
+        else:
+            order = np.arange(self.image_handle.capacity)
+        self.frame_timestamps, self.frame_sequence, self.frame_exposures = (values[order] for values in metadata[:3])
+        self.frame_order = order
+        # the rings are overwritten by the next frames, the state is copied out
+        if out is None:
+            out = np.empty((self.image_handle.capacity, self.height, self.width), dtype=np.uint8)
+        state = np.take(self.image_handle.reduced('state', count), order, axis=0, out=out)
+        tot_intens = self.image_handle.reduced('tot_intens', count)[order]
+        self.captured_frames = count
+        self.dropped_frames = self.image_handle.dropped_frames(count)
         self.image_handle.reset()
         end_film = time.time()
         if verbose:
             print('CAMERA_TIME', end_film - begin_film)
 
-        tot_intens = [np.sum(image) for image in images]
+        tot_intens_device = None
+        if read_device and predicted:
+            # the period filmed is already read, it is rotated to start at the generator max
+            n_samples = int(round(self.trigger.tracker.period * self.trigger.sampler.sample_rate))
+            tot_intens_device = self.trigger.get_intens(n_samples, align=True)
+        elif read_device:
+            tot_intens_device = self.trigger.get_intens()
 
-        tot_intens_device = self.trigger.get_intens()
-        self.trigger.stop()
+        return state, tot_intens, tot_intens_device
 
-        return self._resize(images), tot_intens, tot_intens_device
+    def calc_device_state(self):
+        '''
+        reads the photodiode only, one modulation period of samples if the generator is tracked
+        :return: photodiode samples
+        '''
+        n_samples, tracked = None, self.trigger.tracker.fit()
+        if tracked:
+            n_samples = int(round(self.trigger.tracker.period * self.trigger.sampler.sample_rate))
+        self.trigger.start()
+        # read right away, the period is rotated to start at the generator max as the sinusoid estimators expect
+        return self.trigger.get_intens(n_samples, align=tracked)
+
+    def _film_until_confident(self, tolerance, predicted):
+        """
+        films until the visibility fitted to the total intensity of the frames is known within tolerance,
+        or for one modulation period
+        :param predicted: the film started at any generator phase, the frame phases come from the tracker
+        :return: number of acquired frames
+        """
+        handle = self.image_handle
+        deadline = time.time() + self.frame_timeout
+        for count in range(min(self.min_adaptive_frames, handle.capacity), handle.capacity):
+            if not handle.wait_ready(deadline - time.time(), count):
+                break
+            arrival_times = handle.metadata(count)[3]
+            visibility, half_width = fit_modulation_interval(handle.reduced('tot_intens', count),
+                                                             self._fringe_phases(arrival_times, predicted))
+            if half_width < tolerance:
+                self.fitted_visibility = float(visibility)
+                return count
+        if not handle.wait_ready(deadline - time.time()):
+            raise TimeoutError('{} frames did not arrive in {} s'.format(handle.capacity, self.frame_timeout))
+        return handle.capacity
+
+    def _fringe_phases(self, arrival_times, predicted):
+        if not predicted:
+            # filmed from the generator max at n_frames per period
+            return modulation_phases(self.image_handle.capacity)[:len(arrival_times)]
+        # the piezo follows the generator, the fringe phase is at 2 pi on the generator max
+        return np.pi * (1 + np.cos(self.trigger.tracker.phase(arrival_times - self.frame_latency)))
+
+    def _fringe_order(self, arrival_times, predicted):
+        """
+        :return: for every frame of a whole period film, the acquired frame of the nearest fringe phase,
+            half a period already passes every fringe phase once
+        """
+        distance = modulation_phases(self.image_handle.capacity)[:, np.newaxis] - \
+            self._fringe_phases(arrival_times, predicted)[np.newaxis, :]
+        return np.argmin(np.abs(np.mod(distance + np.pi, 2 * np.pi) - np.pi), axis=1)
+
+    def _phase_order(self, arrival_times):
+        """
+        :return: the acquired frames sorted by generator phase from the generator max,
+            as wait_for_start would have filmed them, every frame is used once
+        """
+        return np.argsort(self.trigger.tracker.phase(arrival_times - self.frame_latency), kind='stable')
 
     def image(self):
-        return self.image_handle.image()
+        return self.image_handle.image(self.frame_timeout)
 
     def wait_for_start(self):
-        self.trigger.start()
-        for res in self.trigger.is_generator_max():
-            if res:
-                break
-        self.trigger.stop()
-
-    def _resize(self, images):
-        n_imgs = images.shape[0]
-        result = np.zeros(shape=(n_imgs, self.height, self.width), dtype=np.uint8)
-        for i, img in enumerate(images):
-            img = cv2.cv2.resize(img, (self.height, self.width))
-            result[i] = img
-        return result
+        if self.trigger.wait_for_generator_max() is None:
+            raise TimeoutError('no generator max in the photodiode stream, even after calibration')
@@ -56,12 +56,13 @@ class Camera:
 
         for buff in self.img_buffers:
             check(ueye.is_FreeImageMem(self.h_cam, buff.mem_ptr, buff.mem_id))
+        self.img_buffers = []
 
         for i in range(buffer_count):
             buff = ImageBuffer()
-            ueye.is_AllocImageMem(self.h_cam,
-                                  rect.width, rect.height, bpp,
-                                  buff.mem_ptr, buff.mem_id)
+            check(ueye.is_AllocImageMem(self.h_cam,
+                                        rect.width, rect.height, bpp,
+                                        buff.mem_ptr, buff.mem_id))
             
             check(ueye.is_AddToSequence(self.h_cam, buff.mem_ptr, buff.mem_id))
 
@@ -102,6 +103,36 @@ class Camera:
 
         return ueye.is_AOI(self.h_cam, ueye.IS_AOI_IMAGE_SET_AOI, rect_aoi, ueye.sizeof(rect_aoi))
 
+    def set_binning(self, factor):
+        """
+        Bin factor x factor sensor pixels.
+        Returns
+        =======
+        success: bool
+            False if the sensor does not support the factor.
+        """
+        mode = {
+            1: ueye.IS_BINNING_DISABLE,
+            2: ueye.IS_BINNING_2X_VERTICAL | ueye.IS_BINNING_2X_HORIZONTAL,
+            4: ueye.IS_BINNING_4X_VERTICAL | ueye.IS_BINNING_4X_HORIZONTAL,
+        }[factor]
+        return ueye.is_SetBinning(self.h_cam, mode) == ueye.IS_SUCCESS
+
+    def set_subsampling(self, factor):
+        """
+        Read every factor-th sensor pixel in both directions.
+        Returns
+        =======
+        success: bool
+            False if the sensor does not support the factor.
+        """
+        mode = {
+            1: ueye.IS_SUBSAMPLING_DISABLE,
+            2: ueye.IS_SUBSAMPLING_2X_VERTICAL | ueye.IS_SUBSAMPLING_2X_HORIZONTAL,
+            4: ueye.IS_SUBSAMPLING_4X_VERTICAL | ueye.IS_SUBSAMPLING_4X_HORIZONTAL,
+        }[factor]
+        return ueye.is_SetSubSampling(self.h_cam, mode) == ueye.IS_SUCCESS
+
     def set_exposure(self, value):
         ms = ueye.DOUBLE(value)
         return ueye.is_Exposure(self.h_cam, ueye.IS_EXPOSURE_CMD_SET_EXPOSURE, ms, ueye.sizeof(ms))
@@ -102,7 +102,10 @@ class MemoryInfo:
 
 
 class ImageData:
-    def __init__(self, h_cam, img_buff):
+    def __init__(self, h_cam, img_buff, copy=True):
+        """
+        :param copy: False to view the driver buffer, it is valid until unlock()
+        """
         self.h_cam = h_cam
         self.img_buff = img_buff
         self.mem_info = MemoryInfo(h_cam, img_buff)
@@ -113,16 +116,27 @@ class ImageData:
                                    self.mem_info.height,
                                    self.mem_info.bits,
                                    self.mem_info.pitch,
-                                   True)
+                                   copy)
 
     def as_1d_image(self):        
         channels = int((7 + self.bits_per_pixel) / 8)
         import numpy
+        # rows are pitch bytes long, the padding is dropped
+        rows = numpy.reshape(self.array, (self.mem_info.height, -1))[:, :self.mem_info.width * channels]
         if channels > 1:
-            return numpy.reshape(self.array, (self.mem_info.height, self.mem_info.width, channels))
+            return numpy.reshape(rows, (self.mem_info.height, self.mem_info.width, channels))
         else:
-            return numpy.reshape(self.array, (self.mem_info.height, self.mem_info.width))
+            return rows
+
 
+    def get_info(self):
+        """
+        :return: driver timestamp of the frame in s (camera clock) and frame sequence number
+        """
+        image_info = ueye.UEYEIMAGEINFO()
+        check(ueye.is_GetImageInfo(self.h_cam, self.img_buff.mem_id, image_info, ueye.sizeof(image_info)))
+        # the device timestamp counts 0.1 us
+        return image_info.u64TimestampDevice.value * 1e-7, image_info.u64FrameNumber.value
 
     def unlock(self):
         check(ueye.is_UnlockSeqBuf(self.h_cam, self.img_buff.mem_id, self.img_buff.mem_ptr))
@@ -153,7 +167,7 @@ class FrameThread(Thread):
                                            img_buffer.mem_ptr,
                                            img_buffer.mem_id)
             if ret == ueye.IS_SUCCESS:
-                self.notify(ImageData(self.cam.handle(), img_buffer))
+                self.notify(ImageData(self.cam.handle(), img_buffer, self.copy))
 
             #break
 
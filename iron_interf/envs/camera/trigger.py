@@ -1,14 +1,149 @@
+import json
 import os
 import serial
 import matplotlib.pyplot as plt
+import threading
 import time
+import warnings
+
+import numpy as np
+
+
+_NEWLINE, _COMMA = ord('\n'), ord(',')
+# bytes a text sample line may contain
+_LINE_CHARS = np.zeros(256, dtype=bool)
+_LINE_CHARS[np.frombuffer(b'0123456789.-+eE, \r\n', dtype=np.uint8)] = True
+_DIGITS = np.zeros(256, dtype=bool)
+_DIGITS[np.frombuffer(b'0123456789', dtype=np.uint8)] = True
+
+# below this the numpy call overhead costs more than converting line by line
+_MIN_VECTORIZED_BYTES = 512
+
+# binary framing: 0xA5 0x5A then the generator and detector values as little endian uint16
+FRAME_SYNC = 0x5AA5
+FRAME_DTYPE = np.dtype([('sync', '<u2'), ('generator', '<u2'), ('detector', '<u2')])
+
+
+def _parse_lines_per_line(lines, verbose=False):
+    samples = []
+    for line in lines.split(b'\n'):
+        try:
+            decoded = line.decode().strip().split(',')
+            if len(decoded) == 2:
+                samples.append((float(decoded[0]), float(decoded[1])))
+        except (UnicodeDecodeError, ValueError):
+            if verbose:
+                print('could not parse {}'.format(line))
+    return np.array(samples, dtype=np.float64).reshape(-1, 2)
+
+
+def _is_well_formed(data):
+    """
+    cheap check that every line is "number,number"
+    """
+    commas, newlines = np.flatnonzero(data == _COMMA), np.flatnonzero(data == _NEWLINE)
+    if len(commas) != len(newlines) or not _LINE_CHARS[data].all():
+        return False
+    # commas and newlines alternate and there is a digit next to every comma
+    return bool(np.all(commas < newlines) and np.all(newlines[:-1] < commas[1:]) and
+                np.all(_DIGITS[data[commas - 1]]) and np.all(_DIGITS[data[commas + 1]]))
+
+
+def _valid_lines(data):
+    """
+    :return: per line mask of the lines with known chars, one comma and digits on both sides of it
+    and the line of every byte
+    """
+    is_newline = data == _NEWLINE
+    is_comma = data == _COMMA
+    # the newline belongs to the line it ends
+    line_ids = np.cumsum(is_newline) - is_newline
+    n_lines = line_ids[-1] + 1
+    bad_chars = np.bincount(line_ids[~_LINE_CHARS[data]], minlength=n_lines)
+    commas = np.bincount(line_ids[is_comma], minlength=n_lines)
+    comma_count = np.cumsum(is_comma)
+    line_begins = np.concatenate(([0], np.flatnonzero(is_newline) + 1))[:n_lines]
+    after_comma = comma_count - (comma_count - is_comma)[line_begins][line_ids] > 0
+    is_digit = _DIGITS[data]
+    digits = np.bincount(2 * line_ids[is_digit] + after_comma[is_digit], minlength=2 * n_lines)
+    return (bad_chars == 0) & (commas == 1) & (digits[0::2] > 0) & (digits[1::2] > 0), line_ids
+
+
+def parse_lines(lines, verbose=False):
+    """
+    arduino convention: "value_generator, value_detector"
+    the lines are checked and converted with whole chunk numpy calls
+    :param lines: bytes of complete lines
+    :return: (n, 2) array of generator, detector samples, malformed lines are skipped
+    """
+    if len(lines) < _MIN_VECTORIZED_BYTES:
+        return _parse_lines_per_line(lines, verbose)
+    data = np.frombuffer(lines, dtype=np.uint8)
+    n_lines = np.count_nonzero(data == _NEWLINE)
+    if not _is_well_formed(data):
+        valid, line_ids = _valid_lines(data)
+        n_lines = np.count_nonzero(valid)
+        if verbose:
+            print('skipped {} malformed lines'.format(len(valid) - n_lines))
+        data = data[valid[line_ids]]
+        if len(data) == 0:
+            return np.empty((0, 2))
+    text = data.tobytes().rstrip().replace(b'\n', b',')
+    try:
+        with warnings.catch_warnings():
+            # a partial conversion only warns
+            warnings.simplefilter('error', DeprecationWarning)
+            samples = np.fromstring(text, sep=',')
+    except (ValueError, DeprecationWarning):
+        samples = None
+    if samples is None or len(samples) != 2 * n_lines:
+        # numbers like "1-2" pass the checks above
+        return _parse_lines_per_line(lines, verbose)
+    return samples.reshape(-1, 2)
+
+
+def parse_frames(chunk):
+    """
+    binary framing, the stream is resynchronized on the sync word after a corrupted frame
+    :return: (n, 2) array of generator, detector samples and the bytes of the incomplete last frame
+    """
+    data = np.frombuffer(chunk, dtype=np.uint8)
+    samples = []
+    begin = 0
+    while True:
+        syncs = np.flatnonzero((data[begin:-1] == FRAME_SYNC & 0xff) & (data[begin + 1:] == FRAME_SYNC >> 8))
+        if len(syncs) == 0:
+            # keep a trailing first sync byte
+            begin = max(begin, len(data) - 1)
+            break
+        begin += syncs[0]
+        n_frames = (len(data) - begin) // FRAME_DTYPE.itemsize
+        frames = data[begin: begin + n_frames * FRAME_DTYPE.itemsize].view(FRAME_DTYPE)
+        broken = np.flatnonzero(frames['sync'] != FRAME_SYNC)
+        n_good = broken[0] if len(broken) else n_frames
+        samples.append(np.stack([frames['generator'][:n_good], frames['detector'][:n_good]], axis=1))
+        begin += n_good * FRAME_DTYPE.itemsize
+        if not len(broken):
+            break
+        # skip the sync word of the broken frame
+        begin += 1
+    samples = np.concatenate(samples).astype(np.float64) if samples else np.empty((0, 2))
+    return samples, chunk[begin:]
 
 
 class SerialPortReader(object):
     # Changed from 2 to 1
-    def __init__(self, name='/dev/ttyACM0'):
+    def __init__(self, name='/dev/ttyACM0', timeout=0.1, framing='text'):
+        """
+        :param framing: "text" lines of the arduino convention or "binary" FRAME_DTYPE frames
+        """
+        assert framing in ('text', 'binary'), 'unknown framing == {} options are "text", "binary"'.format(framing)
         self.dev = serial.Serial()
         self.dev.setPort(name)
+        # read_samples blocks at most timeout seconds
+        self.dev.timeout = timeout
+        self.framing = framing
+        self._partial_line = b''
 
     def get_data(self, verbose=False):
         """
@@ -30,8 +165,22 @@ class SerialPortReader(object):
                     if verbose:
                         print('can not decode {}'.format(line))
 
+    def read_samples(self):
+        """
+        reads everything the port has buffered, blocks until some data or the timeout
+        :return: (n, 2) array of generator, detector samples of the complete lines
+        """
+        chunk = self._partial_line + self.dev.read(max(1, self.dev.inWaiting()))
+        if self.framing == 'binary':
+            samples, self._partial_line = parse_frames(chunk)
+            return samples
+        end = chunk.rfind(b'\n') + 1
+        self._partial_line = chunk[end:]
+        return parse_lines(chunk[:end])
+
     def open(self):
         self.dev.open()
+        self._partial_line = b''
 
     def close(self):
         self.dev.close()
@@ -39,60 +188,388 @@ class SerialPortReader(object):
     def flush(self):
         while self.dev.inWaiting() > 0:
             self.dev.read_all()
+        self._partial_line = b''
+
+
+class SerialSampler(threading.Thread):
+    """
+    keeps the port open and reads the photodiode stream into a ring of timestamped
+    (generator, detector) samples, sample i of the stream is stored at i % ring_size
+    """
+    def __init__(self, reader, ring_size=4096, sample_rate=360):
+        """
+        :param sample_rate: samples per second, to timestamp the samples of a chunk
+        """
+        super(SerialSampler, self).__init__()
+        self.daemon = True
+        self.reader = reader
+        self.ring_size = ring_size
+        self.sample_rate = sample_rate
+        self.running = False
+        self.times = np.zeros(ring_size)
+        self.values = np.zeros((ring_size, 2))
+        self.write_index = 0
+        # error that stopped the thread, raised to the readers of the stream
+        self.error = None
+        # guards the ring, notified on every chunk
+        self.condition = threading.Condition()
+
+    def start(self):
+        self.reader.open()
+        self.reader.flush()
+        self.running = True
+        super(SerialSampler, self).start()
+
+    def stop(self):
+        self.running = False
+        self.join()
+        self.reader.close()
+
+    def run(self):
+        try:
+            while self.running:
+                samples = self.reader.read_samples()[-self.ring_size:]
+                if len(samples) == 0:
+                    continue
+                # the last sample of the chunk just arrived
+                times = time.time() - np.arange(len(samples) - 1, -1, -1) / float(self.sample_rate)
+                with self.condition:
+                    slots = np.arange(self.write_index, self.write_index + len(samples)) % self.ring_size
+                    self.times[slots] = times
+                    self.values[slots] = samples
+                    self.write_index += len(samples)
+                    self.condition.notify_all()
+        except Exception as e:
+            # e.g. the port is unplugged, the waiting readers get the error instead of waiting forever
+            with self.condition:
+                self.error = e
+                self.condition.notify_all()
+
+    def _check_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def wait_for_index(self, index, timeout=None):
+        """
+        :return: False if the stream has not reached index after timeout seconds
+        """
+        with self.condition:
+            ready = self.condition.wait_for(lambda: self.write_index >= index or self.error is not None, timeout)
+            self._check_error()
+            return ready
+
+    def samples(self, begin, end):
+        """
+        :param begin, end: stream indexes, the samples must be still in the ring
+        :return: times, generator and detector values of the samples begin to end
+        """
+        with self.condition:
+            self._check_error()
+            assert begin >= self.write_index - self.ring_size and end <= self.write_index, \
+                'samples {}:{} are not in the ring, stream at {}'.format(begin, end, self.write_index)
+            slots = np.arange(begin, end) % self.ring_size
+            return self.times[slots], self.values[slots, 0], self.values[slots, 1]
+
+    def last(self, count):
+        with self.condition:
+            return self.samples(self.write_index - count, self.write_index)
+
+
+class PeakDetector(object):
+    """
+    generator max detection on whole chunks of samples: a sample is past the max when it is above
+    the threshold and lower than the sample buff_size - 1 before it, a max is the first sample of such a run,
+    the last buff_size - 1 samples are kept for the next chunk
+    """
+    def __init__(self, buff_size=2, history=None, triggered=False):
+        """
+        :param history: the buff_size - 1 samples before the first chunk, zeros if None
+        :param triggered: True to skip a run the first chunk starts in
+        """
+        assert buff_size >= 2, 'buff_size == {} must be at least 2'.format(buff_size)
+        self.history = np.zeros(buff_size - 1) if history is None else np.asarray(history, dtype=np.float64)
+        self.triggered = triggered
+
+    def process(self, values, threshold):
+        """
+        :return: per sample mask of the samples past the max and the indexes of the maxima
+        """
+        if len(values) == 0:
+            return np.zeros(0, dtype=bool), np.zeros(0, dtype=np.int64)
+        lag = len(self.history)
+        extended = np.concatenate((self.history, values))
+        past_max = (values > threshold) & (extended[:-lag] > values)
+        maxima = np.flatnonzero(past_max & ~np.concatenate(([self.triggered], past_max[:-1])))
+        self.history = extended[-lag:]
+        self.triggered = past_max[-1]
+        return past_max, maxima
+
+
+class PhaseTracker(object):
+    """
+    fits offset + amplitude * cos(omega * t - theta) to the last generator samples,
+    the phase is 0 at the generator max
+    """
+    def __init__(self, sampler, window=3., n_iterations=4, max_residual=0.2):
+        """
+        :param window: seconds of samples to fit, a few modulation periods
+        :param max_residual: rms residual relative to the amplitude of an acceptable fit
+        """
+        self.sampler = sampler
+        self.window = window
+        self.n_iterations = n_iterations
+        self.max_residual = max_residual
+        self.offset = None
+        self.amplitude = None
+        self.omega = None
+        self.theta = None
+        self.ref_time = None
+
+    def fit(self):
+        """
+        :return: True if the generator sine is tracked
+        """
+        n_samples = int(self.window * self.sampler.sample_rate)
+        if self.sampler.write_index < n_samples:
+            return False
+        times, values, _ = self.sampler.last(n_samples)
+        t = times - times[-1]
+
+        # the spectrum peak is refined by gauss-newton on the frequency
+        n_fft = 8 * n_samples
+        spectrum = np.abs(np.fft.rfft(values - values.mean(), n_fft))
+        freqs = np.fft.rfftfreq(n_fft, (t[-1] - t[0]) / (n_samples - 1))
+        omega = 2 * np.pi * freqs[np.argmax(spectrum[1:]) + 1]
+        basis = np.stack([np.ones(n_samples), np.cos(omega * t), np.sin(omega * t)], axis=1)
+        offset, a, b = np.linalg.lstsq(basis, values, rcond=None)[0]
+        for _ in range(self.n_iterations):
+            cos, sin = np.cos(omega * t), np.sin(omega * t)
+            jac = np.stack([np.ones(n_samples), cos, sin, t * (b * cos - a * sin)], axis=1)
+            residual = values - (offset + a * cos + b * sin)
+            d_offset, d_a, d_b, d_omega = np.linalg.lstsq(jac, residual, rcond=None)[0]
+            offset, a, b, omega = offset + d_offset, a + d_a, b + d_b, omega + d_omega
+
+        residual = values - (offset + a * np.cos(omega * t) + b * np.sin(omega * t))
+        amplitude = np.hypot(a, b)
+        if omega <= 0 or np.sqrt(np.mean(residual ** 2)) > self.max_residual * amplitude:
+            return False
+        self.offset, self.amplitude, self.omega = offset, amplitude, omega
+        self.theta = np.arctan2(b, a)
+        self.ref_time = times[-1]
+        return True
+
+    @property
+    def period(self):
+        return 2 * np.pi / self.omega
+
+    def phase(self, t):
+        """
+        :return: phase in [0, 2 pi) of the generator at host times t, 0 at the max
+        """
+        return np.mod(self.omega * (np.asarray(t) - self.ref_time) - self.theta, 2 * np.pi)
+
+    def next_max(self, t):
+        return t + (2 * np.pi - self.phase(t)) / self.omega
 
 
 class CameraTrigger(object):
-    def __init__(self, buff_size=2, threshold_coeff=0.8):
-        self.reader = SerialPortReader()
+    default_calibration_path = os.path.join(os.path.expanduser('~'), '.iron_interf', 'trigger_calibration.json')
+    # seconds the stream may lag behind sample_rate before a read gives up
+    stream_timeout = 1.
+    # seconds wait_for_generator_max waits by default, a few generator periods
+    max_wait = 3.
+
+    def __init__(self, buff_size=2, threshold_coeff=0.8, reader=None, sample_rate=360, n_samples=360,
+                 calibration_path=default_calibration_path, calibration_max_age=24 * 3600., calibration_time=5.,
+                 tracking_window=3., tracking_rate=0.2, calibration_check_time=1.5, calibration_tolerance=0.1):
+        """
+        :param n_samples: photodiode samples returned by get_intens
+        :param calibration_path: json file of the generator max, None to calibrate at every init
+        :param calibration_max_age: seconds the saved calibration is reused
+        :param calibration_time: seconds of samples to find the generator max
+        :param calibration_check_time: seconds of samples the saved generator max is checked against,
+            more than a generator period
+        :param calibration_tolerance: relative difference of the saved and the live generator max
+            above which the trigger is calibrated again
+        :param tracking_window: seconds of samples of the generator max in update_threshold
+        :param tracking_rate: weight of the last window in the tracked generator max
+        """
+        self.reader = reader if reader is not None else SerialPortReader()
+        self.sampler = SerialSampler(self.reader, sample_rate=sample_rate)
+        self.tracker = PhaseTracker(self.sampler)
         self.buff_size = buff_size
-        self.threshold = threshold_coeff
-        self.triggered = False
+        self.n_samples = n_samples
+        self.threshold_coeff = threshold_coeff
+        self.calibration_path = calibration_path
+        self.calibration_max_age = calibration_max_age
+        self.calibration_time = calibration_time
+        self.tracking_window = tracking_window
+        self.tracking_rate = tracking_rate
+        self.calibration_check_time = calibration_check_time
+        self.calibration_tolerance = calibration_tolerance
+        self.max_value = None
+        self.threshold = None
+        self.start_index = None
+        # host time of the last calibration, saved with the tracked max so the cache still expires
+        self.calibrated_at = None
 
     def init(self):
-        self.reader.open()
-        begin = time.time()
-        max_value = -1
-        for value, value_detector in self.reader.get_data():
-            print(value, 'time', time.time() - begin)
-            # something strange appears
-            if value > max_value and value < 1000:
-                max_value = value
-            if time.time() - begin > 5:
-                break
-
+        self.sampler.start()
+        max_value = self._load_calibration()
+        if max_value is not None and not self._matches_stream(max_value):
+            print('saved generator max {} does not match the photodiode stream'.format(max_value))
+            max_value = None
+        if max_value is None:
+            max_value = self.calibrate()
         print('max_value', max_value)
-        self.threshold *= max_value
-        self.reader.close()
+        self._set_max_value(max_value)
 
-    def is_generator_max(self):
-        # yield True
-        buffer = [0.0] * self.buff_size
-        for value, value_detector in self.reader.get_data():
-            buffer = buffer[1:] + [value]
-            if value > self.threshold and buffer[0] - buffer[-1] > 0:
-                if not self.triggered:
-                    self.triggered = True
-                    yield True
-            else:
-                self.triggered = False
-                yield False
-
-    def get_intens(self):
-        res, second_sin_start = [], 60
-        buffer = [0.0] * self.buff_size
-        for value_generator, value in self.reader.get_data():
-            buffer = buffer[1:] + [value_generator]
-            res.append(value)
-            if value_generator > self.threshold and buffer[0] - buffer[-1] > 0:
-                second_sin_start = len(res)
-            if len(res) == 120 * 3:
-                break
-
-        return res, second_sin_start
+    def close(self):
+        self.sampler.stop()
+        self._save_calibration()
 
-    def start(self):
-        self.reader.open()
-        self.reader.flush()
+    def calibrate(self):
+        """
+        :return: generator max over calibration_time seconds of samples
+        """
+        begin = self.sampler.write_index
+        end = begin + int(self.calibration_time * self.sampler.sample_rate)
+        self._wait_for_samples(end)
+        _, generator, _ = self.sampler.samples(begin, end)
+        max_value = self._max_value(generator)
+        if max_value is None:
+            if self.max_value is None:
+                raise RuntimeError('no generator sample below 1000 in {} s, check the photodiode stream'.format(
+                    self.calibration_time))
+            print('trigger calibration failed, the generator max stays {}'.format(self.max_value))
+            return self.max_value
+        self._set_max_value(max_value)
+        self.calibrated_at = time.time()
+        self._save_calibration()
+        return max_value
 
-    def stop(self):
-        self.reader.close()
+    def _matches_stream(self, max_value):
+        """
+        :return: True if the generator max of calibration_check_time seconds of samples is max_value
+        """
+        begin = self.sampler.write_index
+        end = begin + int(self.calibration_check_time * self.sampler.sample_rate)
+        self._wait_for_samples(end)
+        _, generator, _ = self.sampler.samples(begin, end)
+        live_max = self._max_value(generator)
+        return live_max is not None and abs(live_max - max_value) <= self.calibration_tolerance * max_value
+
+    def update_threshold(self):
+        """
+        follows the drift of the generator amplitude with the last tracking_window seconds of samples
+        """
+        n_samples = int(self.tracking_window * self.sampler.sample_rate)
+        if self.sampler.write_index < n_samples:
+            return
+        _, generator, _ = self.sampler.last(n_samples)
+        max_value = self._max_value(generator)
+        if max_value is not None:
+            self._set_max_value(self.max_value + self.tracking_rate * (max_value - self.max_value))
+
+    @staticmethod
+    def _max_value(generator):
+        # something strange appears
+        generator = generator[generator < 1000]
+        return float(generator.max()) if len(generator) else None
+
+    def _set_max_value(self, max_value):
+        self.max_value = max_value
+        self.threshold = self.threshold_coeff * max_value
+
+    def _load_calibration(self):
+        if self.calibration_path is None or not os.path.exists(self.calibration_path):
+            return None
+        try:
+            with open(self.calibration_path) as f:
+                calibration = json.load(f)
+            if time.time() - calibration['time'] < self.calibration_max_age:
+                self.calibrated_at = calibration['time']
+                return float(calibration['max_value'])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print('can not read trigger calibration {}: {}'.format(self.calibration_path, e))
+        return None
+
+    def _save_calibration(self):
+        if self.calibration_path is None or self.max_value is None or self.calibrated_at is None:
+            return
+        os.makedirs(os.path.dirname(self.calibration_path), exist_ok=True)
+        with open(self.calibration_path, 'w') as f:
+            json.dump({'max_value': self.max_value, 'time': self.calibrated_at}, f)
+
+    def wait_for_generator_max(self, timeout=None, recalibrate=True):
+        """
+        :param timeout: seconds, max_wait by default
+        :param recalibrate: without a max before the timeout, calibrate the threshold and wait once more,
+            the generator amplitude may have changed since the calibration
+        :return: stream index of the next generator max, None if there is none
+        """
+        timeout = self.max_wait if timeout is None else timeout
+        index = self._find_generator_max(timeout)
+        if index is None and recalibrate:
+            print('no generator max above {} in {} s, calibrating'.format(self.threshold, timeout))
+            self.calibrate()
+            index = self._find_generator_max(timeout)
+        return index
+
+    def _find_generator_max(self, timeout):
+        index = self.sampler.write_index
+        # a max the stream is already past does not count
+        detector = self._peak_detector(index, triggered=True)
+        deadline = time.time() + timeout
+        while self.sampler.wait_for_index(index + 1, max(deadline - time.time(), 0)):
+            end = self.sampler.write_index
+            _, generator, _ = self.sampler.samples(index, end)
+            _, maxima = detector.process(generator, self.threshold)
+            if len(maxima):
+                return index + maxima[0]
+            index = end
+        return None
+
+    def get_intens(self, n_samples=None, align=False):
+        """
+        :param n_samples: number of samples, self.n_samples by default
+        :param align: rotate the samples to start at the generator max of the fitted tracker,
+            n_samples must cover one generator period
+        :return: detector samples from start() on and the index after the last sample past the generator max
+        """
+        n_samples = self.n_samples if n_samples is None else n_samples
+        self._wait_for_samples(self.start_index + n_samples)
+        times, generator, detector = self.sampler.samples(self.start_index, self.start_index + n_samples)
+        if align:
+            # a whole period is periodic, so the samples before the max go to the end
+            shift = int(round((2 * np.pi - self.tracker.phase(times[0])) / self.tracker.omega *
+                              self.sampler.sample_rate)) % n_samples
+            generator, detector = np.roll(generator, -shift), np.roll(detector, -shift)
+            peak_detector = PeakDetector(self.buff_size, generator[len(generator) - self.buff_size + 1:])
+        else:
+            peak_detector = self._peak_detector(self.start_index)
+        past_max, _ = peak_detector.process(generator, self.threshold)
+        past_max = np.flatnonzero(past_max)
+        second_sin_start = past_max[-1] + 1 if len(past_max) else 60
+
+        self.update_threshold()
+        return detector, second_sin_start
+
+    def _wait_for_samples(self, index):
+        timeout = max(index - self.sampler.write_index, 0) / float(self.sampler.sample_rate) + self.stream_timeout
+        if not self.sampler.wait_for_index(index, timeout):
+            raise TimeoutError('photodiode stream at sample {} did not reach {} in {} s'.format(
+                self.sampler.write_index, index, timeout))
+
+    def _peak_detector(self, index, triggered=False):
+        """
+        :return: PeakDetector for the samples from stream index on
+        """
+        history = None
+        if index >= self.buff_size - 1:
+            _, history, _ = self.sampler.samples(index - self.buff_size + 1, index)
+        return PeakDetector(self.buff_size, history, triggered)
+
+    def start(self):
+        # get_intens returns the samples from here on
+        self.start_index = self.sampler.write_index
@@ -0,0 +1,206 @@
+import gym
+import numpy as np
+
+from .iron_interf_env import IronInterfEnv
+from .iron_interf_sim_env import IronInterfSimEnv
+from .utils import unit_vector, rotate, reflect, project
+from .visibility import modulation_phases, min_max
+
+
+class IronInterfBatchSim(object):
+    """
+    steps n_envs IronInterfSimEnv at once, the state of all envs is kept in arrays
+    and every step is computed with whole batch numpy calls
+
+    the beams are gaussian with linear and quadratic phase, so the fields are products
+    of x and y profiles, the profiles are computed on n_points and the frames are built from them
+    """
+    single_observation_space = IronInterfEnv.observation_space
+    single_action_space = IronInterfEnv.action_space
+
+    chunk_size = 8
+
+    max_screw_values = np.array([
+        IronInterfEnv.far_mirror_max_screw_value,
+        IronInterfEnv.far_mirror_max_screw_value,
+        IronInterfEnv.near_mirror_max_screw_value,
+        IronInterfEnv.near_mirror_max_screw_value,
+        IronInterfEnv.lens1_max_screw_value,
+        IronInterfEnv.lens2_max_screw_value
+    ])
+
+    def __init__(self, n_envs, noise=0., reward='visib_minus_1'):
+        '''
+        :param n_envs: number of simulated interferometers
+        :param noise: std of the camera noise, off by default as it costs more than the fields
+        :param reward: "visib_minus_1" or "delta_visib" as in IronInterfEnv.set_calc_reward
+        '''
+        assert reward in ('visib_minus_1', 'delta_visib'), \
+            'unknown reward_calc == {} optnions are "visib_minus1", "delta_visib"'.format(reward)
+
+        self.n_envs = n_envs
+        self.noise = noise
+        self.reward = reward
+        self.exposure = 0.5
+        self.rng = np.random.default_rng()
+
+        self.observation_space = gym.spaces.Box(
+            low=0, high=255, shape=(n_envs,) + IronInterfEnv.observation_space.shape, dtype=np.uint8)
+        self.action_space = gym.spaces.Box(
+            low=-1, high=1, shape=(n_envs, IronInterfEnv.n_actions), dtype=np.float64)
+
+        # screw positions in motor units in IronInterfEnv._take_action order
+        self.screws = np.zeros((n_envs, IronInterfEnv.n_actions))
+        self.n_steps = np.zeros(n_envs, dtype=np.int64)
+        self.visib = np.zeros(n_envs)
+        self.state = np.zeros(self.observation_space.shape, dtype=np.uint8)
+
+        n = IronInterfSimEnv.n_points * IronInterfSimEnv.subpixels
+        self._coords = ((np.arange(n) + 0.5) / n - 0.5) * IronInterfSimEnv.camera_size
+        # the modulation passes every phase twice per period, only the distinct frames are computed
+        phases = modulation_phases(IronInterfSimEnv.n_frames)
+        phases, self._frame_index = np.unique(np.round(phases, 12), return_inverse=True)
+        self._modulation = np.exp(1j * phases)
+        self._frames = np.empty((self.chunk_size, len(phases), IronInterfSimEnv.n_points, IronInterfSimEnv.n_points),
+                                dtype=np.float32)
+
+    def seed(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.action_space.seed(seed)
+
+    def set_exposure(self, value):
+        self.exposure = value
+
+    def reset(self, actions=None, mask=None):
+        '''
+        reset to absolute position
+        :param actions: (n_envs, n_actions) absolute position to reset, random if None
+        :param mask: (n_envs,) bool, reset only these envs
+        :return: state
+        '''
+        if mask is None:
+            mask = np.ones(self.n_envs, dtype=bool)
+        if actions is None:
+            # Prevent from going out of scope
+            actions = self.rng.uniform(-0.9, 0.9, size=(self.n_envs, IronInterfEnv.n_actions))
+
+        self.screws[mask] = self._to_motor_units(actions)[mask]
+        self.n_steps[mask] = 0
+
+        state, visib = self._calc_state(mask)
+        self.state[mask] = state
+        self.visib[mask] = visib
+        return self.state
+
+    def step(self, actions):
+        '''
+        :param actions: (n_envs, n_actions)
+        :return: state, reward, done, info with (n_envs,) arrays
+        '''
+        self.n_steps += 1
+        self.screws = np.clip(self.screws + self._to_motor_units(actions), -self.max_screw_values, self.max_screw_values)
+
+        self.state, visib = self._calc_state()
+        if self.reward == 'visib_minus_1':
+            reward = visib - 1.
+        else:
+            reward = visib - self.visib
+        self.visib = visib
+
+        done = (self.visib > IronInterfEnv.done_visibility) | (self.n_steps >= IronInterfEnv.max_steps)
+        return self.state, reward, done, {'visib_camera': visib}
+
+    def _to_motor_units(self, actions):
+        return np.trunc(np.asarray(actions) * self.max_screw_values)
+
+    def _trace_beams(self, screws):
+        """
+        IronInterfSimEnv._trace_beam with the batched utils kernels
+        :return: (N, 3) beam offsets from the camera center and (N, 3) beam directions
+        """
+        n = screws.shape[0]
+        angles = screws / self.max_screw_values
+        mirror1_normal = self._tilt_mirrors(
+            np.array([0, 1, -1]),
+            angles[:, 1] * IronInterfSimEnv.far_mirror_max_angle,
+            angles[:, 0] * IronInterfSimEnv.far_mirror_max_angle
+        )
+        mirror2_normal = self._tilt_mirrors(
+            np.array([0, -1, 1]),
+            angles[:, 3] * IronInterfSimEnv.near_mirror_max_angle,
+            angles[:, 2] * IronInterfSimEnv.near_mirror_max_angle
+        )
+        mirror2_center = np.array([0, IronInterfSimEnv.mirrors_distance, 0])
+        camera_center = np.array([0, IronInterfSimEnv.mirrors_distance, IronInterfSimEnv.camera_distance])
+        camera_normal = np.array([0, 0, -1])
+
+        direction = reflect(np.array([0, 0, 1]), mirror1_normal)
+        position = project(np.zeros((n, 3)), direction, mirror2_normal, mirror2_center)
+        direction = reflect(direction, mirror2_normal)
+        position = project(position, direction, camera_normal, camera_center)
+
+        return position - camera_center, direction
+
+    @staticmethod
+    def _tilt_mirrors(normal, angles_x, angles_y):
+        normals = rotate(unit_vector(normal), np.array([1, 0, 0]), angles_y)
+        return rotate(normals, np.cross(normals, [1, 0, 0]), angles_x)
+
+    def _profiles(self, offsets, tilts, curvatures):
+        """
+        1d reference and test amplitudes and the test phase along one camera axis, binned to n_points
+        :return: (N, n_points) reference intensity, test intensity and complex interference term
+        """
+        k = 2 * np.pi / IronInterfSimEnv.wavelength
+        w2 = IronInterfSimEnv.beam_radius ** 2
+        coords = self._coords[np.newaxis, :]
+        test_r2 = (coords - offsets[:, np.newaxis]) ** 2
+
+        reference_amplitude = np.exp(-coords ** 2 / w2)
+        test_amplitude = np.exp(-test_r2 / w2)
+        phase = k * (tilts[:, np.newaxis] * coords + curvatures[:, np.newaxis] * test_r2 / 2)
+
+        shape = (offsets.shape[0], IronInterfSimEnv.n_points, IronInterfSimEnv.subpixels)
+        return (
+            np.broadcast_to(reference_amplitude ** 2, test_r2.shape).reshape(shape).mean(axis=-1),
+            (test_amplitude ** 2).reshape(shape).mean(axis=-1),
+            (reference_amplitude * test_amplitude * np.exp(1j * phase)).reshape(shape).mean(axis=-1)
+        )
+
+    def _calc_state(self, mask=None):
+        screws = self.screws if mask is None else self.screws[mask]
+        offsets, directions = self._trace_beams(screws)
+        curvatures = screws[:, 4] / IronInterfEnv.lens1_max_screw_value * IronInterfSimEnv.lens1_max_curvature + \
+            screws[:, 5] / IronInterfEnv.lens2_max_screw_value * IronInterfSimEnv.lens2_max_curvature
+
+        reference_x, test_x, interference_x = self._profiles(offsets[:, 0], directions[:, 0], curvatures)
+        reference_y, test_y, interference_y = self._profiles(offsets[:, 1], directions[:, 1], curvatures)
+
+        # a frame is background + Re(interference * exp(1j * phase)), both are outer products of the y and x
+        # profiles, so every (y, x) frame is a rank 4 matrix product of (y, 4) and (4, x) factors
+        gain = 255. / 4 * self.exposure / 0.5
+        modulated_y = 2 * interference_y[:, np.newaxis, :] * self._modulation[np.newaxis, :, np.newaxis]
+        factors_y = np.stack(np.broadcast_arrays(
+            reference_y[:, np.newaxis], test_y[:, np.newaxis], modulated_y.real, -modulated_y.imag
+        ), axis=-1)
+        factors_y = (gain * factors_y).astype(np.float32)
+        factors_x = np.stack([reference_x, test_x, interference_x.real, interference_x.imag], axis=1)
+        factors_x = factors_x.astype(np.float32)[:, np.newaxis]
+
+        # envs are processed in chunks so that the float frames stay in cache, only the uint8 frames go to memory
+        n = screws.shape[0]
+        state = np.empty((n,) + IronInterfEnv.observation_space.shape, dtype=np.uint8)
+        tot_intens = np.empty((n, len(self._modulation)), dtype=np.float32)
+        for begin in range(0, n, self.chunk_size):
+            end = min(begin + self.chunk_size, n)
+            frames = self._frames[:end - begin]
+            np.matmul(factors_y[begin:end], factors_x[begin:end], out=frames)
+            if self.noise > 0:
+                frames += self.noise * self.rng.standard_normal(frames.shape, dtype=np.float32)
+            # same as the uint8 cast, integer sums are exact in float32 for 64x64 pixels
+            np.clip(frames, 0, 255, out=frames)
+            np.floor(frames, out=frames)
+            tot_intens[begin:end] = frames.sum(axis=(2, 3))
+            state[begin:end] = frames[:, self._frame_index]
+
+        return state, min_max(tot_intens)
@@ -1,16 +1,24 @@
+import functools
 import gym
 from matplotlib import pyplot as plt
 import numpy as np
 import time as tm
 
-from .mirrors.motor_controller import get_position, get_home_position, wait_for_motor, move_relative, ControllerType
-from .camera.ids_camera import IDSCamera
+from .mirrors.motor_controller import init as init_motors, get_position, get_home_position, wait_for_motors, \
+    move_relative, move_relative_batch, ControllerType
+from .camera.ids_camera import IDSCamera, downsample_frames
+from .visibility import modulation_phases, fit_modulation, contrast_phase_map, estimators, \
+    frame_estimators
 
 
 class IronInterfEnv(gym.Env):
     n_points = 64
     n_frames = 16
     n_actions = 6
+    # photodiode samples of the compact observation
+    n_device_points = 64
+    # photodiode signal without light
+    device_dark = 50.
 
     # mirror screw step l / L, (ratio of delta screw length to vertical distance)
     far_mirror_max_screw_value = 5000 * 0.9
@@ -21,7 +29,10 @@ class IronInterfEnv(gym.Env):
     metadata = {'render.modes': ['human', 'rgb_array', 'last_state']}
     reward_range = (0, 1)
 
+    # default frame stack, instances with other n_frames or n_points have their own observation_space
     observation_space = gym.spaces.Box(low=0, high=255, shape=(n_frames, n_points, n_points), dtype=np.uint8)
+    # 10 bit arduino samples
+    device_observation_space = gym.spaces.Box(low=0, high=1023, shape=(n_device_points,), dtype=np.float32)
     action_space = gym.spaces.Box(low=-1, high=1, shape=(n_actions,), dtype=np.float64)
 
     done_visibility = 0.9999
@@ -40,22 +51,39 @@ class IronInterfEnv(gym.Env):
         'lens2_screw': 1
     }
 
-    def __init__(self):
-        self.init_mirror1_screw_x = get_position(ControllerType.MIRROR, IronInterfEnv.mirror2motor['mirror1_screw_x'])
-        self.init_mirror1_screw_y = get_position(ControllerType.MIRROR, IronInterfEnv.mirror2motor['mirror1_screw_y'])
-        self.init_mirror2_screw_x = get_position(ControllerType.MIRROR, IronInterfEnv.mirror2motor['mirror2_screw_x'])
-        self.init_mirror2_screw_y = get_position(ControllerType.MIRROR, IronInterfEnv.mirror2motor['mirror2_screw_y'])
-        self.init_lens1_screw = get_position(ControllerType.LENS, IronInterfEnv.lens2motor['lens1_screw'])
-        self.init_lens2_screw = get_position(ControllerType.LENS, IronInterfEnv.lens2motor['lens2_screw'])
+    def __init__(self, simulated=False, capture_mode='software', n_points=None, n_frames=None, pyramid=(),
+                 sync='wait'):
+        '''
+        :param simulated: run on simulated camera, trigger and motor controllers, no hardware is needed
+        :param capture_mode: "software" crops full sensor frames on the host, "sensor" crops and bins on the camera
+        :param n_points: frame side in pixels, IronInterfEnv.n_points by default
+        :param n_frames: frames per modulation period, IronInterfEnv.n_frames by default
+        :param pyramid: coarser frame sides, e.g. (16, 32), downsampled from every capture to info['pyramid'],
+            set_observation_points observes one of them
+        :param sync: "wait" films from the next generator max, "predict" films right away and orders the frames
+            by the tracked generator phase, see IDSCamera
+        '''
+        self._init_state(n_points, n_frames, pyramid)
+        # the motor backend, real and simulated envs use their own controllers
+        self.simulated = simulated
+        init_motors(simulated)
+        self.init_mirror1_screw_x = self._position(ControllerType.MIRROR, IronInterfEnv.mirror2motor['mirror1_screw_x'])
+        self.init_mirror1_screw_y = self._position(ControllerType.MIRROR, IronInterfEnv.mirror2motor['mirror1_screw_y'])
+        self.init_mirror2_screw_x = self._position(ControllerType.MIRROR, IronInterfEnv.mirror2motor['mirror2_screw_x'])
+        self.init_mirror2_screw_y = self._position(ControllerType.MIRROR, IronInterfEnv.mirror2motor['mirror2_screw_y'])
+        self.init_lens1_screw = self._position(ControllerType.LENS, IronInterfEnv.lens2motor['lens1_screw'])
+        self.init_lens2_screw = self._position(ControllerType.LENS, IronInterfEnv.lens2motor['lens2_screw'])
 
         for key in IronInterfEnv.mirror2motor:
             motor_id = IronInterfEnv.mirror2motor[key]
             print('{}, home {}; current {}'.format(
-                key, get_home_position(ControllerType.MIRROR, motor_id), get_position(ControllerType.MIRROR, motor_id)))
+                key, get_home_position(ControllerType.MIRROR, motor_id, simulated=self.simulated),
+                self._position(ControllerType.MIRROR, motor_id)))
         for key in IronInterfEnv.lens2motor:
             motor_id = IronInterfEnv.lens2motor[key]
             print('{}, home {}; current {}'.format(
-                key, get_home_position(ControllerType.LENS, motor_id), get_position(ControllerType.LENS, motor_id)))
+                key, get_home_position(ControllerType.LENS, motor_id, simulated=self.simulated),
+                self._position(ControllerType.LENS, motor_id)))
 
         self.mirror1_screw_x = 0
         self.mirror1_screw_y = 0
@@ -64,18 +92,90 @@ class IronInterfEnv(gym.Env):
         self.lens1_screw = 0
         self.lens2_screw = 0
 
-        self.camera = IDSCamera(IronInterfEnv.n_frames, IronInterfEnv.n_points, IronInterfEnv.n_points)
+        self.camera = IDSCamera(self.n_frames, self.n_points, self.n_points, simulated, capture_mode, sync=sync)
+
+    def _init_state(self, n_points, n_frames, pyramid):
+        '''
+        resolution, state, modes and estimators, shared with the simulated env that has no hardware to init
+        '''
+        self.n_points = IronInterfEnv.n_points if n_points is None else n_points
+        self.n_frames = IronInterfEnv.n_frames if n_frames is None else n_frames
+        for points in pyramid:
+            assert 0 < points < self.n_points and self.n_points % points == 0, \
+                'pyramid level {} does not divide n_points == {}'.format(points, self.n_points)
+        self.pyramid = tuple(sorted(set(pyramid)))
+        self.observation_points = self.n_points
 
         self.state = None
         self.n_steps = None
         self.info = None
         self.visib = None
         self.camera_enabled = True
+        self.device_enabled = True
+        self.compact_observation = False
+        self.observation_mode = 'frames'
+        self.motion_mode = 'concurrent'
+        self.capture_tolerance = None
 
         self._calc_reward = self._calc_reward_visib_minus_1
+        self._estimators = {}
+        self.set_calc_visib('min_max', 'camera')
+        self.set_calc_visib('trimmed_extrema', 'device', n_points=15, dark=self.device_dark)
+        self.observation_space = self._observation_space()
 
-    def enable_camera(self, enabled):
+    def enable_camera(self, enabled, compact_observation=False):
+        '''
+        :param enabled: False to take the state and reward from the trigger photodiode only,
+            a step then films nothing and reads about one modulation period of samples
+        :param compact_observation: with the camera disabled, observe the photodiode samples resampled
+            to n_device_points instead of an empty frame stack
+        '''
         self.camera_enabled = enabled
+        self.compact_observation = compact_observation and not enabled
+        self.observation_space = self._observation_space()
+
+    def set_observation_mode(self, mode):
+        '''
+        :param mode: "frames" the frame stack, "contrast" the 3 x n_points x n_points contrast, fringe phase
+            and mean intensity maps, "frames_contrast" both stacked along the first axis
+        '''
+        assert mode in ('frames', 'contrast', 'frames_contrast'), \
+            'unknown observation_mode == {} options are "frames", "contrast", "frames_contrast"'.format(mode)
+        self.observation_mode = mode
+        self.observation_space = self._observation_space()
+
+    def set_observation_points(self, points):
+        '''
+        :param points: n_points or a pyramid level, side of the observed frames or maps
+        '''
+        assert points == self.n_points or points in self.pyramid, \
+            'unknown observation_points == {} options are {}'.format(points, self.pyramid + (self.n_points,))
+        self.observation_points = points
+        self.observation_space = self._observation_space()
+
+    def _observation_space(self):
+        if self.compact_observation:
+            return IronInterfEnv.device_observation_space
+        # contrast, fringe phase and mean intensity maps scaled to 8 bit
+        n_maps = {'frames': self.n_frames, 'contrast': 3, 'frames_contrast': self.n_frames + 3}[self.observation_mode]
+        shape = (n_maps, self.observation_points, self.observation_points)
+        return gym.spaces.Box(low=0, high=255, shape=shape, dtype=np.uint8)
+
+    def set_capture_tolerance(self, tolerance):
+        '''
+        :param tolerance: stop filming once the visibility fitted to the frames is known within +- tolerance,
+            the frames filmed so far are resampled to n_frames by fringe phase and the camera estimator
+            measures them as any other step, the fitted visibility goes to info['visib_capture_fit'],
+            None films one whole modulation period every step
+        '''
+        self.capture_tolerance = tolerance
+
+    def enable_device(self, enabled):
+        '''
+        :param enabled: False to skip the photodiode read after filming, the visibility and
+            the fringe phase are fitted from the frames
+        '''
+        self.device_enabled = enabled
 
     def set_exposure(self, value):
         if not self.camera_enabled:
@@ -91,6 +191,28 @@ class IronInterfEnv(gym.Env):
         else:
             assert False, 'unknown reward_calc == {} optnions are "visib_minus1", "delta_visib"'.format(method)
 
+    def set_calc_visib(self, method, source='camera', **kwargs):
+        '''
+        :param method: name in visibility.estimators, or in visibility.frame_estimators for the camera
+        :param source: "camera" or "device"
+        :param kwargs: estimator parameters
+        '''
+        assert source in ('camera', 'device'), 'unknown source == {} options are "camera", "device"'.format(source)
+        if source == 'camera' and method in frame_estimators:
+            self._estimators[source] = (functools.partial(frame_estimators[method], **kwargs), True)
+        else:
+            assert method in estimators, 'unknown visib_calc == {} options are {}'.format(
+                method, sorted(estimators) + (sorted(frame_estimators) if source == 'camera' else []))
+            self._estimators[source] = (functools.partial(estimators[method], **kwargs), False)
+
+    def set_motion_mode(self, mode):
+        '''
+        :param mode: "concurrent" starts all axes and waits once, "sequential" waits after every axis
+        '''
+        assert mode in ('concurrent', 'sequential'), \
+            'unknown motion_mode == {} options are "concurrent", "sequential"'.format(mode)
+        self.motion_mode = mode
+
     def get_keys_to_action(self):
         return {
             (ord('w'),): 0,
@@ -124,30 +246,14 @@ class IronInterfEnv(gym.Env):
 
         #print('actions', actions)
         actions = self._to_motor_units(actions)
-
-        for action_id, action_value in enumerate(actions):
-            self._take_action(action_id, action_value)
-            self._wait_for_motors()
+        self._apply_actions(actions)
 
         self.print_rel_state()
         #print('absolute init_m1_x = {}, init_m1_y = {}, init_m2_x = {}, init_m2_y = {}'.format(
         #    self.init_mirror1_screw_x, self.init_mirror1_screw_y, self.init_mirror2_screw_x, self.init_mirror2_screw_y)
         #)
 
-        start = tm.time()
-        self.state, tot_intens_camera, (tot_intens_device, second_sin_start) = self.calc_state()
-        end = tm.time()
-        self.info['state_calc_time'] = end - start
-
-        visib_device = self._calc_visib_device(tot_intens_device)
-        self.info['visib_device'] = visib_device
-        self.info['second_sin_start'] = second_sin_start
-        visib_camera = self._calc_visib_camera(tot_intens_camera)
-        self.info['visib_camera'] = visib_camera
-
-        self.info['tot_intens_device'] = tot_intens_device
-
-        reward = self._calc_reward(visib_camera)
+        reward = self._calc_reward(self._observe())
 
         return self.state, reward, self.game_over(), self.info
 
@@ -171,25 +277,11 @@ class IronInterfEnv(gym.Env):
 
         actions = self._to_motor_units(actions)
         actions += reset_to_zero_action
-
-        for action_id, action_value in enumerate(actions):
-            self._take_action(action_id, action_value)
-            # wait until actions are done
-            self._wait_for_motors()
+        self._apply_actions(actions)
 
         self.print_rel_state()
 
-        self.state, tot_intens_camera, (tot_intens_device, second_sin_start) = self.calc_state()
-
-        visib_device = self._calc_visib_device(tot_intens_device)
-        self.info['visib_device'] = visib_device
-        self.info['secon_sin_start'] = second_sin_start
-
-        visib_camera = self._calc_visib_camera(tot_intens_camera)
-        self.info['visib_camera'] = visib_camera
-
-        self.info['tot_intens_device'] = tot_intens_device
-        self.visib = visib_camera
+        self.visib = self._observe()
 
         print('reset done')
         return self.state
@@ -223,10 +315,30 @@ class IronInterfEnv(gym.Env):
                 assert False, 'Unknown actions {}'.format(actions)
         return result
 
+    def _apply_actions(self, actions):
+        if self.motion_mode == 'concurrent':
+            # start every axis, mirror moves go in one transfer, then wait once for both controllers
+            moves = {ControllerType.MIRROR: [], ControllerType.LENS: []}
+            for action_id, action_value in enumerate(actions):
+                controller_type, motor_id, motor_value = self._clip_action(action_id, action_value)
+                moves[controller_type].append((motor_id, motor_value))
+            for controller_type, controller_moves in moves.items():
+                move_relative_batch(controller_type, controller_moves, simulated=self.simulated)
+            self._wait_for_motors()
+        else:
+            for action_id, action_value in enumerate(actions):
+                self._take_action(action_id, action_value)
+                # wait until actions are done
+                self._wait_for_motors()
+
     def _take_action(self, action_id, value):
+        controller_type, motor_id, motor_value = self._clip_action(action_id, value)
+        move_relative(controller_type, motor_id, motor_value, simulated=self.simulated)
+
+    def _clip_action(self, action_id, value):
         """
         :param action:
-        :return:
+        :return: (controller_type, motor_id, value) of the clipped move
         """
         if action_id == 0:
             mirror1_screw_y = np.clip(
@@ -236,11 +348,7 @@ class IronInterfEnv(gym.Env):
             )
             value_clipped = mirror1_screw_y - self.mirror1_screw_y
             self.mirror1_screw_y = mirror1_screw_y
-            move_relative(
-                controller_type=ControllerType.MIRROR,
-                motor_id=IronInterfEnv.mirror2motor['mirror1_screw_y'],
-                value=int(value_clipped)
-            )
+            move = (ControllerType.MIRROR, IronInterfEnv.mirror2motor['mirror1_screw_y'], int(value_clipped))
         elif action_id == 1:
             mirror1_screw_x = np.clip(
                 self.mirror1_screw_x + value,
@@ -249,11 +357,7 @@ class IronInterfEnv(gym.Env):
             )
             value_clipped = mirror1_screw_x - self.mirror1_screw_x
             self.mirror1_screw_x = mirror1_screw_x
-            move_relative(
-                controller_type=ControllerType.MIRROR,
-                motor_id=IronInterfEnv.mirror2motor['mirror1_screw_x'],
-                value=int(value_clipped)
-            )
+            move = (ControllerType.MIRROR, IronInterfEnv.mirror2motor['mirror1_screw_x'], int(value_clipped))
         elif action_id == 2:
             mirror2_screw_y = np.clip(
                 self.mirror2_screw_y + value,
@@ -262,11 +366,7 @@ class IronInterfEnv(gym.Env):
             )
             value_clipped = mirror2_screw_y - self.mirror2_screw_y
             self.mirror2_screw_y = mirror2_screw_y
-            move_relative(
-                controller_type=ControllerType.MIRROR,
-                motor_id=IronInterfEnv.mirror2motor['mirror2_screw_y'],
-                value=int(value_clipped)
-            )
+            move = (ControllerType.MIRROR, IronInterfEnv.mirror2motor['mirror2_screw_y'], int(value_clipped))
         elif action_id == 3:
             mirror2_screw_x = np.clip(
                 self.mirror2_screw_x + value,
@@ -275,11 +375,7 @@ class IronInterfEnv(gym.Env):
             )
             value_clipped = mirror2_screw_x - self.mirror2_screw_x
             self.mirror2_screw_x = mirror2_screw_x
-            move_relative(
-                controller_type=ControllerType.MIRROR,
-                motor_id=IronInterfEnv.mirror2motor['mirror2_screw_x'],
-                value=int(value_clipped)
-            )
+            move = (ControllerType.MIRROR, IronInterfEnv.mirror2motor['mirror2_screw_x'], int(value_clipped))
         elif action_id == 4:
             lens_screw = np.clip(
                 self.lens1_screw + value,
@@ -288,11 +384,7 @@ class IronInterfEnv(gym.Env):
             )
             value_clipped = lens_screw - self.lens1_screw
             self.lens1_screw = lens_screw
-            move_relative(
-                controller_type=ControllerType.LENS,
-                motor_id=IronInterfEnv.lens2motor['lens1_screw'],
-                value=-int(value_clipped)
-            )
+            move = (ControllerType.LENS, IronInterfEnv.lens2motor['lens1_screw'], -int(value_clipped))
         elif action_id == 5:
             lens_screw = np.clip(
                 self.lens2_screw + value,
@@ -301,11 +393,7 @@ class IronInterfEnv(gym.Env):
             )
             value_clipped = lens_screw - self.lens2_screw
             self.lens2_screw = lens_screw
-            move_relative(
-                controller_type=ControllerType.LENS,
-                motor_id=IronInterfEnv.lens2motor['lens2_screw'],
-                value=-int(value_clipped)
-            )
+            move = (ControllerType.LENS, IronInterfEnv.lens2motor['lens2_screw'], -int(value_clipped))
         else:
             assert False, 'unknown action = {}'.format(action_id)
 
@@ -313,11 +401,14 @@ class IronInterfEnv(gym.Env):
             print('WARNING: step overflow')
             self.print_rel_state()
 
+        return move
+
+    def _position(self, controller_type, motor_id):
+        return get_position(controller_type, motor_id, simulated=self.simulated)
+
     def _wait_for_motors(self):
-        for motor_id in IronInterfEnv.mirror2motor.values():
-            wait_for_motor(ControllerType.MIRROR, motor_id)
-        for motor_id in IronInterfEnv.lens2motor.values():
-            wait_for_motor(ControllerType.LENS, motor_id)
+        wait_for_motors(ControllerType.MIRROR, list(IronInterfEnv.mirror2motor.values()), simulated=self.simulated)
+        wait_for_motors(ControllerType.LENS, list(IronInterfEnv.lens2motor.values()), simulated=self.simulated)
 
     def _calc_reward_visib_minus_1(self, visib):
         self.visib = visib
@@ -328,23 +419,14 @@ class IronInterfEnv(gym.Env):
         self.visib = visib
         return self.visib - prev_visib
 
-    def _calc_visib_camera(self, tot_intens):
-        def visib(vmin, vmax):
-            return (vmax - vmin) / (vmax + vmin)
-
-        imin, imax = min(tot_intens), max(tot_intens)
-
-
-        return visib(float(min(tot_intens)), float(max(tot_intens)))
+    def _calc_visib_camera(self, tot_intens, frames=None):
+        estimator, on_frames = self._estimators['camera']
+        return float(estimator(frames if on_frames else tot_intens))
 
     def _calc_visib_device(self, tot_intens):
-        vals = sorted(tot_intens)
+        vals = np.asarray(tot_intens)
 
-        print('DEVICE VISIB: ', vals[0], vals[-1])
-
-        npoints = 15
-        minv = np.sum(vals[:npoints]) / npoints
-        maxv = np.sum(vals[-npoints:]) / npoints
+        print('DEVICE VISIB: ', vals.min(), vals.max())
 
         ## To measure dark
         # alpha = 0.9
@@ -363,12 +445,8 @@ class IronInterfEnv(gym.Env):
         #
         # print('Min_v={}, Max_v={}, Avg_v={}, Median_v={}, vals_len={}'.format(minv, maxv, np.mean(vals), np.median(vals), len(vals)))
 
-        self.info['imin'] = minv
-        self.info['imax'] = maxv
-        # dark = 15
-        dark = 50
-
-        return (maxv - minv) / (maxv + minv - 2 * dark)
+        estimator, _ = self._estimators['device']
+        return float(estimator(vals))
 
     def game_over(self):
         return self.visib > IronInterfEnv.done_visibility or \
@@ -391,8 +469,82 @@ class IronInterfEnv(gym.Env):
 
     def calc_state(self):
         if self.camera_enabled:
-            return self.camera.calc_state()
-        return None, [1] * IronInterfEnv.n_frames
+            return self.camera.calc_state(read_device=self.device_enabled, tolerance=self.capture_tolerance)
+        return None, None, self.camera.calc_device_state()
+
+    def _observe(self):
+        '''
+        sets the state and the info of the current position
+        :return: camera visibility, photodiode visibility if the camera is disabled
+        '''
+        start = tm.time()
+        state, tot_intens_camera, device = self.calc_state()
+        end = tm.time()
+        self.info['state_calc_time'] = end - start
+
+        if device is not None:
+            tot_intens_device, second_sin_start = device
+            visib_device = self._calc_visib_device(tot_intens_device)
+            self.info['visib_device'] = visib_device
+            self.info['second_sin_start'] = second_sin_start
+            self.info['tot_intens_device'] = tot_intens_device
+        else:
+            for key in ('visib_device', 'second_sin_start', 'tot_intens_device'):
+                self.info.pop(key, None)
+        if not self.camera_enabled:
+            for key in ('visib_camera', 'visib_fit', 'visib_capture_fit', 'fringe_phase', 'pyramid', 'dropped_frames',
+                        'frame_timestamps', 'captured_frames', 'frame_order'):
+                self.info.pop(key, None)
+            self.state = self._device_observation(tot_intens_device)
+            return visib_device
+
+        if self.pyramid:
+            # the levels are downsampled from the same capture, so they are consistent with each other
+            levels = {points: downsample_frames(state, points, points)[0] for points in self.pyramid}
+            levels[self.n_points] = state
+            self.info['pyramid'] = levels
+            self.state = self._camera_observation(levels[self.observation_points])
+        else:
+            self.state = self._camera_observation(state)
+        visib_camera = self._calc_visib_camera(tot_intens_camera, state)
+        self.info['visib_camera'] = visib_camera
+        if self.camera is not None and self.camera.fitted_visibility is not None:
+            # the visibility the adaptive capture stopped on
+            self.info['visib_capture_fit'] = self.camera.fitted_visibility
+        else:
+            self.info.pop('visib_capture_fit', None)
+        # the frames start at the generator max and cover one modulation period
+        self.info['visib_fit'], self.info['fringe_phase'] = fit_modulation(
+            tot_intens_camera, modulation_phases(len(tot_intens_camera)))
+        self._update_frame_info()
+        return visib_camera
+
+    def _camera_observation(self, frames):
+        if self.observation_mode == 'frames':
+            return frames
+        contrast, phase, intensity = contrast_phase_map(frames)
+        maps = np.stack([
+            np.round(255 * contrast),
+            np.mod(np.round(256 / (2 * np.pi) * phase), 256),
+            np.round(intensity)
+        ]).astype(np.uint8)
+        if self.observation_mode == 'contrast':
+            return maps
+        return np.concatenate([frames, maps])
+
+    def _device_observation(self, tot_intens_device):
+        if not self.compact_observation:
+            return np.zeros(self.observation_space.shape, dtype=self.observation_space.dtype)
+        samples = np.asarray(tot_intens_device, dtype=np.float32)
+        positions = np.linspace(0, len(samples) - 1, self.n_device_points)
+        return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+    def _update_frame_info(self):
+        if self.camera_enabled and self.camera is not None:
+            self.info['dropped_frames'] = self.camera.dropped_frames
+            self.info['frame_timestamps'] = self.camera.frame_timestamps
+            self.info['captured_frames'] = self.camera.captured_frames
+            self.info['frame_order'] = self.camera.frame_order
 
     def print_rel_state(self):
         print('relative m1_x = {}, m1_y = {}, m2_x = {}, m2_y = {}, lens1 = {}, lens2 = {}'.format(
@@ -0,0 +1,147 @@
+import numpy as np
+
+from .iron_interf_env import IronInterfEnv
+from .utils import unit_vector, rotate, reflect, project
+from .visibility import modulation_phases
+
+
+class IronInterfSimEnv(IronInterfEnv):
+    """
+    digital twin of the bench: the beam is traced through the two mirrors to the camera,
+    the lenses detune the wavefront curvature and the fringes are computed instead of filmed
+    """
+    # lengths in mm
+    wavelength = 633e-6
+    mirrors_distance = 100.
+    camera_distance = 300.
+    beam_radius = 1.
+    camera_size = 4.
+
+    # mirror tilt in rad at the max screw value
+    far_mirror_max_angle = 2.5e-4
+    near_mirror_max_angle = 2.5e-4
+    # wavefront curvature in 1/mm at the max screw value
+    lens1_max_curvature = 1.5e-3
+    lens2_max_curvature = 1e-3
+
+    # camera pixel is averaged over subpixels x subpixels points to not alias dense fringes
+    subpixels = 2
+    n_device_samples = 360
+    device_gain = 300.
+
+    def __init__(self, noise=1., n_points=None, n_frames=None, pyramid=()):
+        '''
+        :param noise: std of the camera and photodiode noise
+        :param n_points: frame side in pixels
+        :param n_frames: frames per modulation period
+        :param pyramid: coarser frame sides as in IronInterfEnv
+        '''
+        # no motors and camera to init, IronInterfEnv.__init__ is not called
+        self._init_state(n_points, n_frames, pyramid)
+        self.reset_mirror_positions()
+
+        self.camera = None
+        self.exposure = 0.5
+        self.noise = noise
+        self.rng = np.random.default_rng()
+
+        n = self.n_points * IronInterfSimEnv.subpixels
+        coords = ((np.arange(n) + 0.5) / n - 0.5) * IronInterfSimEnv.camera_size
+        self._x, self._y = np.meshgrid(coords, coords)
+
+        # capture starts at the generator max and covers one modulation period
+        self._frame_phases = modulation_phases(self.n_frames)
+        self._device_phases = modulation_phases(IronInterfSimEnv.n_device_samples)
+
+    def set_exposure(self, value):
+        self.exposure = value
+
+    def seed(self, seed=None):
+        super(IronInterfSimEnv, self).seed(seed)
+        self.rng = np.random.default_rng(seed)
+
+    def render(self, mode='human', close=False):
+        if mode == 'rgb_array':
+            return self.state[:1]
+        return super(IronInterfSimEnv, self).render(mode, close)
+
+    def close(self):
+        pass
+
+    def _apply_actions(self, actions):
+        # motors move instantly
+        for action_id, action_value in enumerate(actions):
+            self._clip_action(action_id, action_value)
+
+    def _trace_beam(self):
+        """
+        :return: beam offset from the camera center and beam direction
+        """
+        mirror1_normal = self._tilt_mirror(
+            unit_vector([0, 1, -1]),
+            self.mirror1_screw_x / self.far_mirror_max_screw_value * self.far_mirror_max_angle,
+            self.mirror1_screw_y / self.far_mirror_max_screw_value * self.far_mirror_max_angle
+        )
+        mirror2_normal = self._tilt_mirror(
+            unit_vector([0, -1, 1]),
+            self.mirror2_screw_x / self.near_mirror_max_screw_value * self.near_mirror_max_angle,
+            self.mirror2_screw_y / self.near_mirror_max_screw_value * self.near_mirror_max_angle
+        )
+        mirror2_center = np.array([0, self.mirrors_distance, 0])
+        camera_center = np.array([0, self.mirrors_distance, self.camera_distance])
+        camera_normal = np.array([0, 0, -1])
+
+        # the beam comes along z to the first mirror at the origin
+        direction = reflect(np.array([0, 0, 1]), mirror1_normal)
+        position = project(np.zeros(3), direction, mirror2_normal, mirror2_center)
+        direction = reflect(direction, mirror2_normal)
+        position = project(position, direction, camera_normal, camera_center)
+
+        return position - camera_center, direction
+
+    @staticmethod
+    def _tilt_mirror(normal, angle_x, angle_y):
+        normal = rotate(normal, np.array([1, 0, 0]), angle_y)
+        return rotate(normal, np.cross(normal, [1, 0, 0]), angle_x)
+
+    def _calc_fields(self):
+        """
+        :return: per pixel background intensity and complex interference term
+        """
+        offset, direction = self._trace_beam()
+        k = 2 * np.pi / self.wavelength
+        curvature = self.lens1_screw / self.lens1_max_screw_value * self.lens1_max_curvature + \
+            self.lens2_screw / self.lens2_max_screw_value * self.lens2_max_curvature
+
+        test_r2 = (self._x - offset[0]) ** 2 + (self._y - offset[1]) ** 2
+        reference_amplitude = np.exp(-(self._x ** 2 + self._y ** 2) / self.beam_radius ** 2)
+        test_amplitude = np.exp(-test_r2 / self.beam_radius ** 2)
+        phase = k * (direction[0] * self._x + direction[1] * self._y + curvature * test_r2 / 2)
+
+        background = reference_amplitude ** 2 + test_amplitude ** 2
+        interference = 2 * reference_amplitude * test_amplitude * np.exp(1j * phase)
+
+        shape = (self.n_points, self.subpixels, self.n_points, self.subpixels)
+        return background.reshape(shape).mean(axis=(1, 3)), interference.reshape(shape).mean(axis=(1, 3))
+
+    def calc_state(self):
+        background, interference = self._calc_fields()
+
+        state, tot_intens = None, None
+        if self.camera_enabled:
+            # 0.5 ms exposure fills the 8 bit range for the aligned beams
+            gain = 255. / 4 * self.exposure / 0.5
+            frames = background + np.real(interference * np.exp(1j * self._frame_phases)[:, np.newaxis, np.newaxis])
+            frames = gain * frames + self.noise * self.rng.standard_normal(frames.shape)
+            state = np.clip(frames, 0, 255).astype(np.uint8)
+            tot_intens = [np.sum(image) for image in state]
+
+        if self.camera_enabled and not self.device_enabled:
+            return state, tot_intens, None
+
+        # the photodiode sees the whole beam
+        tot_intens_device = np.mean(background) + np.real(np.mean(interference) * np.exp(1j * self._device_phases))
+        tot_intens_device = self.device_dark + self.device_gain * tot_intens_device + \
+            self.noise * self.rng.standard_normal(self.n_device_samples)
+
+        return state, tot_intens, (list(tot_intens_device), self.n_device_samples)
@@ -1,5 +1,4 @@
 from enum import Enum
-from .standa.standa_controller import StandaController
 from .newport.newport_controller import NewportController
 
 
@@ -8,45 +7,113 @@ class ControllerType(Enum):
     LENS = 1
 
 
-_standa = StandaController()
-_newport = NewportController()
+# both controllers of every backend, keyed by simulated, so real and simulated envs coexist
+_controllers = {}
 
 
-def wait_for_motor(controller_type, motor_id):
+def init(simulated=False):
+    """
+    connect both controllers of a backend, they are connected on first use if init is not called
+    :param simulated: use simulated controllers, no hardware is needed
+    """
+    if simulated in _controllers:
+        return
+
+    if simulated:
+        from .standa.standa_sim import SimStandaController
+        standa = SimStandaController()
+    else:
+        from .standa.standa_controller import StandaController
+        standa = StandaController()
+    _controllers[simulated] = {ControllerType.LENS: standa, ControllerType.MIRROR: NewportController(simulated)}
+
+
+def _standa(simulated=False):
+    init(simulated)
+    return _controllers[simulated][ControllerType.LENS]
+
+
+def _newport(simulated=False):
+    init(simulated)
+    return _controllers[simulated][ControllerType.MIRROR]
+
+
+def wait_for_motor(controller_type, motor_id, simulated=False):
+    if controller_type == ControllerType.MIRROR:
+        return _newport(simulated).wait_for_motor(motor_id)
+    elif controller_type == ControllerType.LENS:
+        return _standa(simulated).wait_for_stop(motor_id)
+    else:
+        raise ValueError(f'unknown controller_type {controller_type}')
+
+
+def wait_for_motors(controller_type, motor_ids, simulated=False):
+    if controller_type == ControllerType.MIRROR:
+        return _newport(simulated).wait_for_motors(motor_ids)
+    elif controller_type == ControllerType.LENS:
+        for motor_id in motor_ids:
+            _standa(simulated).wait_for_stop(motor_id)
+    else:
+        raise ValueError(f'unknown controller_type {controller_type}')
+
+
+def is_moving(controller_type, motor_id, simulated=False):
+    if controller_type == ControllerType.MIRROR:
+        return _newport(simulated).is_moving(motor_id)
+    elif controller_type == ControllerType.LENS:
+        return _standa(simulated).is_moving(motor_id)
+    else:
+        raise ValueError(f'unknown controller_type {controller_type}')
+
+
+def move_relative(controller_type, motor_id, value, wait=True, simulated=False):
+    """
+    :param wait: block until a lens move is done, mirror moves never block
+    :param simulated: move the simulated backend, every function takes it
+    """
     if controller_type == ControllerType.MIRROR:
-        return _newport.wait_for_motor(motor_id)
+        return _newport(simulated).move_relative(motor_id, value)
     elif controller_type == ControllerType.LENS:
-        return _standa.wait_for_stop(motor_id)
+        return _standa(simulated).move_relative(motor_id, value, 0, wait)
     else:
         raise ValueError(f'unknown controller_type {controller_type}')
 
 
-def move_relative(controller_type, motor_id, value):
+def move_relative_batch(controller_type, moves, simulated=False):
+    """
+    start several moves without waiting for them
+    :param moves: list of (motor_id, value)
+    """
     if controller_type == ControllerType.MIRROR:
-        return _newport.move_relative(motor_id, value)
+        return _newport(simulated).move_relative_batch(moves)
     elif controller_type == ControllerType.LENS:
-        return _standa.move_relative(motor_id, value, 0)
+        for motor_id, value in moves:
+            _standa(simulated).move_relative(motor_id, value, 0, wait=False)
     else:
         raise ValueError(f'unknown controller_type {controller_type}')
 
 
-def get_home_position(controller_type, motor_id):
+def get_home_position(controller_type, motor_id, simulated=False):
     if controller_type == ControllerType.MIRROR:
-        return _newport.get_home_position(motor_id)
+        return _newport(simulated).get_home_position(motor_id)
     elif controller_type == ControllerType.LENS:
         return 0
     else:
         raise ValueError(f'unknown controller_type {controller_type}')
 
 
-def get_position(controller_type, motor_id):
+def get_position(controller_type, motor_id, simulated=False):
     if controller_type == ControllerType.MIRROR:
-        return _newport.get_position(motor_id)
+        return _newport(simulated).get_position(motor_id)
     elif controller_type == ControllerType.LENS:
-        return _standa.get_position(motor_id)
+        return _standa(simulated).get_position(motor_id)
     else:
         raise ValueError(f'unknown controller_type {controller_type}')
 
 
-def close():
-    _standa.close()
+def close(simulated=None):
+    """
+    :param simulated: backend to disconnect, both by default
+    """
+    for key in [key for key in _controllers if simulated is None or key == simulated]:
+        _controllers.pop(key)[ControllerType.LENS].close()
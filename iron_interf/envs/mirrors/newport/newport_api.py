@@ -234,6 +234,35 @@ class Controller(object):
             return self.parse_reply(reply)
 
 
+    def command_batch(self, newfocus_commands):
+        """Send several NewFocus formated commands in a single USB transfer
+
+        Commands are joined with ';' into one line [2 - 6.1.2], the replies of
+        all queries are read back together and split per query.
+
+        Args:
+            newfocus_commands (list): Legal commands listed in usermanual [2 - 6.2]
+
+        Returns:
+            replies (list): Human readable replies, one per query command
+        """
+        if not newfocus_commands:
+            return []
+
+        usb_commands = [self.parse_command(c).rstrip('\r') for c in newfocus_commands]
+        n_replies = sum('?' in c for c in newfocus_commands)
+
+        self.send_command(';'.join(usb_commands) + '\r')
+
+        # every reply is terminated by '\r\n' and may span several reads
+        replies, pending = [], ''
+        while len(replies) < n_replies:
+            pending += ''.join([chr(x) for x in self.ep_in.read(100)])
+            *lines, pending = pending.split('\n')
+            replies += [line.strip() for line in lines if line.strip()]
+        return replies
+
+
     def start_console(self):
         """Continuously ask user for a command
         """
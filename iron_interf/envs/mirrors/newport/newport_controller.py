@@ -1,22 +1,47 @@
-from .newport_api import Controller
+import time
 
 
 class NewportController(object):
-    def __init__(self):
-        # run lsusb to get the address
-        self._mirror_controller = Controller(idProduct=0x4000, idVendor=0x104d)
+    def __init__(self, simulated=False):
+        if simulated:
+            from .newport_sim import SimController
+            self._mirror_controller = SimController()
+        else:
+            from .newport_api import Controller
+            # run lsusb to get the address
+            self._mirror_controller = Controller(idProduct=0x4000, idVendor=0x104d)
 
     def wait_for_motor(self, motor_id):
-        motor_done_cmd = '{}MD?'.format(motor_id)
-        is_done = False
-        while not is_done:
-            resp = self._mirror_controller.command(motor_done_cmd)
-            is_done = int(resp[2])
+        self.wait_for_motors([motor_id])
+
+    def wait_for_motors(self, motor_ids, min_interval=0.001, max_interval=0.05):
+        """
+        poll MD? of all motors in one transfer, doubling the interval while any of them moves
+        :param min_interval: first polling interval in seconds
+        :param max_interval: polling interval limit in seconds
+        """
+        interval = min_interval
+        while any(self.are_moving(motor_ids)):
+            time.sleep(interval)
+            interval = min(2 * interval, max_interval)
+
+    def is_moving(self, motor_id):
+        return self.are_moving([motor_id])[0]
+
+    def are_moving(self, motor_ids):
+        replies = self._mirror_controller.command_batch(['{}MD?'.format(motor_id) for motor_id in motor_ids])
+        return [not int(resp[2]) for resp in replies]
 
     def move_relative(self, motor_id, value):
         move_motor_cmd = '{}PR{}'.format(motor_id, value)
         self._mirror_controller.command(move_motor_cmd)
 
+    def move_relative_batch(self, moves):
+        """
+        :param moves: list of (motor_id, value), sent in one transfer
+        """
+        self._mirror_controller.command_batch(['{}PR{}'.format(motor_id, value) for motor_id, value in moves])
+
     def move_absolute(self, motor_id, value):
         move_motor_cmd = '{}PA{}'.format(motor_id, value)
         self._mirror_controller.command(move_motor_cmd)
@@ -27,6 +52,10 @@ class NewportController(object):
     def get_position(self, motor_id):
         return int(self._mirror_controller.command('{}TP?'.format(motor_id))[2:])
 
+    def get_positions(self, motor_ids):
+        replies = self._mirror_controller.command_batch(['{}TP?'.format(motor_id) for motor_id in motor_ids])
+        return [int(resp[2:]) for resp in replies]
+
     def set_home_position(self, motor_id, value):
         self._mirror_controller.command('{}DH{}'.format(motor_id, value))
 
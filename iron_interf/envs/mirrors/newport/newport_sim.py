@@ -0,0 +1,76 @@
+import re
+import time
+
+from ..sim_axis import SimAxis
+
+# same as newport_api.NEWFOCUS_COMMAND_REGEX, kept here to not import usb
+NEWFOCUS_COMMAND_REGEX = re.compile("([0-9]{0,1})([a-zA-Z?]{2,})([0-9+-]*)")
+
+
+class SimController(object):
+    """Simulated 8742 Picomotor Controller
+
+    Accepts the subset of NewFocus commands used by NewportController and replies
+    in the same '1>value' format as Controller. Every transfer costs transfer_time.
+    """
+
+    def __init__(self, n_motors=4, speed=2000, transfer_time=0.001):
+        """
+        Args:
+            n_motors (int): number of connected picomotors
+            speed (int): motor velocity in steps per second
+            transfer_time (float): USB round trip in seconds
+        """
+        self.motors = {motor_id: SimAxis(speed) for motor_id in range(1, n_motors + 1)}
+        self.home = {motor_id: 0 for motor_id in self.motors}
+        self.transfer_time = transfer_time
+
+    def command(self, newfocus_command):
+        replies = self.command_batch([newfocus_command])
+        if '?' in newfocus_command:
+            return replies[0]
+
+    def command_batch(self, newfocus_commands):
+        time.sleep(self.transfer_time)
+        replies = []
+        for newfocus_command in newfocus_commands:
+            reply = self._execute(newfocus_command)
+            if '?' in newfocus_command:
+                replies.append(reply)
+        return replies
+
+    def _execute(self, newfocus_command):
+        m = NEWFOCUS_COMMAND_REGEX.match(newfocus_command)
+        if not m:
+            raise ValueError('Command {} was not a valid format'.format(newfocus_command))
+
+        driver_number, command, parameter = m.groups()
+        command = command.upper()
+
+        if command == 'VE?':
+            return '8742 sim 0.1 0'
+        if command == 'ST':
+            for motor in self.motors.values():
+                motor.stop()
+            return None
+
+        motor_id = int(driver_number)
+        motor = self.motors[motor_id]
+        if command == 'PR':
+            motor.move_by(int(parameter))
+        elif command == 'PA':
+            motor.move_to(int(parameter))
+        elif command == 'DH':
+            self.home[motor_id] = int(parameter or 0)
+        elif command == 'MD?':
+            return '1>{}'.format(int(not motor.is_moving()))
+        elif command == 'TP?':
+            return '1>{}'.format(motor.position())
+        elif command == 'PA?':
+            return '1>{}'.format(motor.target())
+        elif command == 'DH?':
+            return '1>{}'.format(self.home[motor_id])
+        elif command == 'QM?':
+            return '1>3'
+        else:
+            raise ValueError('Command {} is not simulated'.format(newfocus_command))
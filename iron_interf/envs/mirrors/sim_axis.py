@@ -0,0 +1,37 @@
+import time
+
+
+class SimAxis(object):
+    """
+    stepper axis moving with a constant speed, the position is evaluated from the wall clock
+    """
+    def __init__(self, speed, position=0):
+        self.speed = speed
+        self._start_position = position
+        self._target = position
+        self._start_time = time.time()
+
+    def position(self):
+        elapsed = time.time() - self._start_time
+        distance = self._target - self._start_position
+        if elapsed * self.speed >= abs(distance):
+            return self._target
+        direction = 1 if distance > 0 else -1
+        return int(self._start_position + direction * elapsed * self.speed)
+
+    def target(self):
+        return self._target
+
+    def is_moving(self):
+        return self.position() != self._target
+
+    def move_to(self, target):
+        self._start_position = self.position()
+        self._start_time = time.time()
+        self._target = int(target)
+
+    def move_by(self, value):
+        self.move_to(self._target + value)
+
+    def stop(self):
+        self.move_to(self.position())
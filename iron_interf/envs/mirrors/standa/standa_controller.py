@@ -1,5 +1,6 @@
 from . import pyximc
 import ctypes
+import time
 
 
 def _open(lib):
@@ -60,18 +61,37 @@ class StandaController(object):
         result = self.lib.get_position(self.device_ids[device_id], ctypes.byref(x_pos))
         return x_pos.Position, x_pos.uPosition
 
-    def move_absolute(self, device_id, distance, udistance):
+    def move_absolute(self, device_id, distance, udistance, wait=True):
         result = self.lib.command_move(self.device_ids[device_id], distance, udistance)
-        return self.wait_for_stop(device_id)
-
-    def move_relative(self, device_id, distance, udistance):
-        pos, upos = self.get_position(device_id)
-        return self.move_absolute(device_id, pos + distance, upos + udistance)
+        if wait:
+            return self.wait_for_stop(device_id)
+        return repr(result)
 
-    def wait_for_stop(self, device_id, interval=100):
-        result = self.lib.command_wait_for_stop(self.device_ids[device_id], interval)
+    def move_relative(self, device_id, distance, udistance, wait=True):
+        # command_movr shifts the target on the controller, no position round trip
+        result = self.lib.command_movr(self.device_ids[device_id], distance, udistance)
+        if wait:
+            return self.wait_for_stop(device_id)
         return repr(result)
 
+    def is_moving(self, device_id):
+        x_status = pyximc.status_t()
+        result = self.lib.get_status(self.device_ids[device_id], ctypes.byref(x_status))
+        if result != pyximc.Result.Ok:
+            # the stage may still move or be in error, do not report it as stopped
+            raise RuntimeError('standa device {} get_status failed: {}'.format(device_id, repr(result)))
+        return bool(x_status.MoveSts & pyximc.MoveState.MOVE_STATE_MOVING)
+
+    def wait_for_stop(self, device_id, interval=0.5):
+        """
+        poll the move status instead of command_wait_for_stop, which sleeps in whole milliseconds
+        :param interval: polling interval in ms
+        :raises RuntimeError: if the status can not be read
+        """
+        while self.is_moving(device_id):
+            time.sleep(interval / 1000)
+        return repr(pyximc.Result.Ok)
+
     def set_current(self, device_id, curr_value):
         eng = pyximc.engine_settings_t()
         result = self.lib.get_engine_settings(self.device_ids[device_id], ctypes.byref(eng))
@@ -0,0 +1,46 @@
+import time
+
+from ..sim_axis import SimAxis
+
+# pyximc.Result.Ok, kept here to not load libximc
+_RESULT_OK = 0
+
+
+class SimStandaController(object):
+    """
+    simulated StandaController, every call to the controller costs transfer_time
+    """
+    def __init__(self, n_devices=2, speed=2000, transfer_time=0.001):
+        self.axes = [SimAxis(speed) for _ in range(n_devices)]
+        self.device_ids = list(range(n_devices))
+        self.transfer_time = transfer_time
+
+    def close(self):
+        pass
+
+    def get_position(self, device_id):
+        time.sleep(self.transfer_time)
+        return self.axes[device_id].position(), 0
+
+    def move_absolute(self, device_id, distance, udistance, wait=True):
+        time.sleep(self.transfer_time)
+        self.axes[device_id].move_to(distance)
+        if wait:
+            return self.wait_for_stop(device_id)
+        return repr(_RESULT_OK)
+
+    def move_relative(self, device_id, distance, udistance, wait=True):
+        time.sleep(self.transfer_time)
+        self.axes[device_id].move_by(distance)
+        if wait:
+            return self.wait_for_stop(device_id)
+        return repr(_RESULT_OK)
+
+    def is_moving(self, device_id):
+        time.sleep(self.transfer_time)
+        return self.axes[device_id].is_moving()
+
+    def wait_for_stop(self, device_id, interval=0.5):
+        while self.is_moving(device_id):
+            time.sleep(interval / 1000)
+        return repr(_RESULT_OK)
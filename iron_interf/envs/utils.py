@@ -19,46 +19,63 @@ def rotation_matrix2(axis, theta):
 
 
 def unit_vector(vector):
-    """ Returns the unit vector of the vector.  """
-    return np.asarray(vector) / np.linalg.norm(vector)
+    """ Returns the unit vector of the vector, or of every vector along the last axis.  """
+    vector = np.asarray(vector)
+    return vector / np.linalg.norm(vector, axis=-1, keepdims=True)
 
 
 def cross_product(vector1, vector2):
     return np.cross(vector1, vector2)
 
 
+def dot_product(vector1, vector2):
+    """ dot product along the last axis, broadcasts (N, 3) and (3,) vectors """
+    return np.sum(np.multiply(vector1, vector2), axis=-1)
+
+
 def rotation_matrix(axis, theta):
     """
     Return the rotation matrix associated with counterclockwise rotation about
     the given axis by theta radians.
+    For (N, 3) axes and/or (N,) angles returns (N, 3, 3) matrices.
     """
     axis = unit_vector(axis)
-    cos_theta = math.cos(theta)
-    sin_theta = math.sin(theta)
+    x, y, z = axis[..., 0], axis[..., 1], axis[..., 2]
+    cos_theta = np.cos(theta)
+    sin_theta = np.sin(theta)
     one_minus_cos = 1 - cos_theta
 
-    return np.array([
+    matrix = np.array([
         [
-            cos_theta + one_minus_cos * axis[0] ** 2,
-            one_minus_cos * axis[0] * axis[1] - sin_theta * axis[2],
-            one_minus_cos * axis[0] * axis[2] + sin_theta * axis[1]
+            cos_theta + one_minus_cos * x ** 2,
+            one_minus_cos * x * y - sin_theta * z,
+            one_minus_cos * x * z + sin_theta * y
         ],
         [
-            one_minus_cos * axis[1] * axis[0] + sin_theta * axis[2],
-            cos_theta + one_minus_cos * axis[1] ** 2,
-            one_minus_cos * axis[1] * axis[2] - sin_theta * axis[0]
+            one_minus_cos * y * x + sin_theta * z,
+            cos_theta + one_minus_cos * y ** 2,
+            one_minus_cos * y * z - sin_theta * x
         ],
         [
-            one_minus_cos * axis[2] * axis[0] - sin_theta * axis[1],
-            one_minus_cos * axis[2] * axis[1] + sin_theta * axis[0],
-            cos_theta + one_minus_cos * axis[2] ** 2
+            one_minus_cos * z * x - sin_theta * y,
+            one_minus_cos * z * y + sin_theta * x,
+            cos_theta + one_minus_cos * z ** 2
         ]
     ])
+    return np.moveaxis(matrix, (0, 1), (-2, -1))
 
 
 def rotate(vector, axis, angle):
-    matrix = rotation_matrix(axis, angle)
-    return np.dot(vector.T, matrix)
+    """
+    vector.dot(rotation_matrix(axis, angle)) for (..., 3) vectors and axes and (...) angles,
+    computed with the Rodrigues formula without building the matrices
+    """
+    vector = np.asarray(vector)
+    axis = unit_vector(axis)
+    cos_angle = np.expand_dims(np.cos(angle), -1)
+    sin_angle = np.expand_dims(np.sin(angle), -1)
+    axis_dot = np.expand_dims(dot_product(axis, vector), -1)
+    return vector * cos_angle - np.cross(axis, vector) * sin_angle + axis * axis_dot * (1 - cos_angle)
 
 
 def rotate_x(vector, angle):
@@ -85,28 +102,27 @@ def angle_between(v1, v2):
             0.0
             angle_between((1, 0, 0), (-1, 0, 0))
             3.141592653589793
+
+        (N, 3) vectors give (N,) angles
     """
     v1_u = unit_vector(v1)
     v2_u = unit_vector(v2)
-    return np.arccos(np.clip(np.dot(v1_u, v2_u), -1.0, 1.0))
+    return np.arccos(np.clip(dot_product(v1_u, v2_u), -1.0, 1.0))
 
 
 def reflect(vector, normal):
     """
-    'mirror' reflection
+    'mirror' reflection, vectors and normals are (..., 3)
     :param vector:
-    :param normal:
+    :param normal: mirror normal facing the incoming vector
     :return:
     """
-    rotation_axis = cross_product(normal, vector)
-    alpha = math.pi - angle_between(vector, normal)
-
-    assert alpha > 0 and alpha < math.pi / 2, alpha / math.pi * 180
+    normal = unit_vector(normal)
+    vector_dot = dot_product(vector, normal)
 
-    rotation_angle = math.pi - 2 * alpha
+    assert np.all(vector_dot < 0), 'mirror normal does not face the vector'
 
-    rotated_vector = rotate(vector, rotation_axis, rotation_angle)
-    return rotated_vector
+    return vector - 2 * np.expand_dims(vector_dot, -1) * normal
 
 
 def back_track(target, normal_vector, center):
@@ -116,9 +132,9 @@ def back_track(target, normal_vector, center):
     :param center: center of the light source plane
     :return: source vector
     """
-    dot_scalar = np.dot(np.subtract(target, center), normal_vector)
+    dot_scalar = dot_product(np.subtract(target, center), normal_vector)
     # now returning the position vector of the projection onto the plane
-    return np.subtract(target, dot_scalar * normal_vector)
+    return np.subtract(target, np.expand_dims(dot_scalar, -1) * normal_vector)
 
 
 def project(source, source_normal, target_normal, target_center):
@@ -130,9 +146,9 @@ def project(source, source_normal, target_normal, target_center):
     :param target_center:
     :return:
     """
-    normal_distance = np.dot(np.subtract(source, target_center), target_normal)
-    sx = normal_distance / np.dot(-source_normal, target_normal)
-    return source + source_normal * sx
+    normal_distance = dot_product(np.subtract(source, target_center), target_normal)
+    sx = normal_distance / dot_product(np.negative(source_normal), target_normal)
+    return source + source_normal * np.expand_dims(sx, -1)
 
 
 def dist(a, b):
@@ -142,7 +158,7 @@ def dist(a, b):
     :param b:
     :return:
     """
-    return np.linalg.norm(a-b)
+    return np.linalg.norm(np.subtract(a, b), axis=-1)
 
 
 if __name__ == '__main__':
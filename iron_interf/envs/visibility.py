@@ -0,0 +1,146 @@
+import numpy as np
+
+
+def modulation_phases(n_samples):
+    """
+    fringe phase of n_samples spread over one modulation period from the generator max,
+    the piezo sweeps the phase from 2 pi to 0 and back
+    """
+    return np.pi * (1 + np.cos(2 * np.pi * np.arange(n_samples) / n_samples))
+
+
+def fit_modulation(signals, phases):
+    """
+    least squares fit of background + amplitude * cos(phases + fringe_phase) along the last axis
+    :param signals: (..., n) intensities sampled at the modulation phases
+    :param phases: (n,) modulation phases
+    :return: (...) visibility amplitude / background and fringe phase
+    """
+    basis = np.stack([np.ones_like(phases), np.cos(phases), np.sin(phases)], axis=1)
+    coeffs = np.asarray(signals, dtype=np.float64) @ np.linalg.pinv(basis).T
+    background, a, b = np.moveaxis(coeffs, -1, 0)
+    # nan visibility for dark signals
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.hypot(a, b) / background, np.arctan2(-b, a)
+
+
+# two sided 95% Student t quantiles for 1 to 30 degrees of freedom, the normal one above
+_T95 = np.array([12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+                 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+                 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042])
+
+
+def fit_modulation_interval(signals, phases):
+    """
+    fit_modulation visibility with the half width of its 95% confidence interval, propagated from
+    the covariance of the least squares coefficients, needs more than 3 samples
+    :return: (...) visibility and half width of its interval
+    """
+    dof = len(phases) - 3
+    t = _T95[dof - 1] if dof <= len(_T95) else 1.96
+    signals = np.asarray(signals, dtype=np.float64)
+    basis = np.stack([np.ones_like(phases), np.cos(phases), np.sin(phases)], axis=1)
+    coeffs = signals @ np.linalg.pinv(basis).T
+    residual = signals - coeffs @ basis.T
+    variance = (residual ** 2).sum(axis=-1) / dof
+    background, a, b = np.moveaxis(coeffs, -1, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        amplitude = np.hypot(a, b)
+        # gradient of amplitude / background with respect to the coefficients
+        gradient = np.stack([-amplitude / background ** 2, a / (amplitude * background), b / (amplitude * background)],
+                            axis=-1)
+        std = np.sqrt(variance * np.einsum('...i,ij,...j', gradient, np.linalg.pinv(basis.T @ basis), gradient))
+        return amplitude / background, t * std
+
+
+# visibility estimators of signals sampled along the last axis, any leading axes are a batch,
+# dark is the signal without light
+
+def min_max(signals, dark=0.):
+    signals = np.asarray(signals, dtype=np.float64)
+    vmin, vmax = signals.min(axis=-1), signals.max(axis=-1)
+    return (vmax - vmin) / (vmax + vmin - 2 * dark)
+
+
+def trimmed_means(signals, n_points):
+    """
+    :return: means of the n_points lowest and of the n_points highest values, found by partition
+    """
+    signals = np.asarray(signals, dtype=np.float64)
+    n = signals.shape[-1]
+    n_points = min(n_points, n // 2)
+    parts = np.partition(signals, (n_points - 1, n - n_points), axis=-1)
+    return parts[..., :n_points].mean(axis=-1), parts[..., n - n_points:].mean(axis=-1)
+
+
+def trimmed_extrema(signals, n_points=None, dark=0.):
+    """
+    :param n_points: values averaged at each extreme, 4% of the samples by default
+    """
+    if n_points is None:
+        n_points = max(1, int(round(0.04 * np.shape(signals)[-1])))
+    vmin, vmax = trimmed_means(signals, n_points)
+    return (vmax - vmin) / (vmax + vmin - 2 * dark)
+
+
+def sinusoid_fit(signals, dark=0.):
+    """
+    the samples cover one modulation period from the generator max
+    """
+    signals = np.asarray(signals, dtype=np.float64) - dark
+    return fit_modulation(signals, modulation_phases(signals.shape[-1]))[0]
+
+
+def fourier(signals, n_harmonics=5, dark=0.):
+    """
+    extrema of the signals low passed to their first n_harmonics Fourier components,
+    the piezo sweep puts the fringe signal in the first few harmonics of the modulation
+    """
+    signals = np.asarray(signals, dtype=np.float64)
+    spectrum = np.fft.rfft(signals, axis=-1)
+    spectrum[..., n_harmonics + 1:] = 0
+    return min_max(np.fft.irfft(spectrum, signals.shape[-1], axis=-1), dark)
+
+
+def contrast_map(frames):
+    """
+    :param frames: (..., n_frames, h, w)
+    :return: (..., h, w) temporal (max - min) / (max + min) of every pixel, 0 for dark pixels
+    """
+    frames = np.asarray(frames)
+    vmin, vmax = frames.min(axis=-3).astype(np.float32), frames.max(axis=-3).astype(np.float32)
+    total = vmax + vmin
+    return np.divide(vmax - vmin, total, out=np.zeros_like(total), where=total > 0)
+
+
+def weighted_contrast(frames, dark=0.):
+    """
+    mean of the contrast map weighted by the pixel intensity
+    :param dark: pixel value without light
+    """
+    frames = np.asarray(frames)
+    vmin, vmax = frames.min(axis=-3).astype(np.float64), frames.max(axis=-3).astype(np.float64)
+    return (vmax - vmin).sum(axis=(-2, -1)) / (vmax + vmin - 2 * dark).sum(axis=(-2, -1))
+
+
+estimators = {
+    'min_max': min_max,
+    'trimmed_extrema': trimmed_extrema,
+    'sinusoid_fit': sinusoid_fit,
+    'fourier': fourier,
+}
+
+# estimators of frame stacks (..., n_frames, h, w)
+frame_estimators = {
+    'weighted_contrast': weighted_contrast,
+}
+
+
+def contrast_phase_map(frames):
+    """
+    :param frames: (..., n_frames, h, w) covering one modulation period from the generator max
+    :return: (..., h, w) contrast map, fringe phase and mean intensity of every pixel
+    """
+    frames = np.asarray(frames)
+    _, phase = fit_modulation(np.moveaxis(frames, -3, -1), modulation_phases(frames.shape[-3]))
+    return contrast_map(frames), phase, frames.mean(axis=-3)
@@ -0,0 +1,22 @@
+from iron_interf.envs import IronInterfSimEnv, IronInterfBatchSim
+import numpy as np
+import time
+
+
+if __name__ == '__main__':
+    n_envs = 8
+    actions = np.random.uniform(-0.9, 0.9, size=(n_envs, IronInterfSimEnv.n_actions))
+
+    batch = IronInterfBatchSim(n_envs)
+    batch_state = batch.reset(actions)
+    env = IronInterfSimEnv(noise=0)
+    for i in range(n_envs):
+        state = env.reset(actions[i].copy())
+        print('max diff', np.abs(state.astype(int) - batch_state[i]).max(), 'visib', env.visib, batch.visib[i])
+
+    batch = IronInterfBatchSim(1024)
+    batch.reset()
+    begin = time.time()
+    for _ in range(10):
+        batch.step(np.random.uniform(-0.1, 0.1, size=(1024, IronInterfSimEnv.n_actions)))
+    print('steps per second', 10 * 1024 / (time.time() - begin))
@@ -0,0 +1,42 @@
+from iron_interf.envs import IronInterfSimEnv, IronInterfBatchSim
+from iron_interf.envs.utils import unit_vector, rotate, reflect, project, rotation_matrix
+import numpy as np
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    n = 64
+
+    # the batched kernels give the results of the one vector calls
+    vectors = rng.normal(size=(n, 3))
+    axes = rng.normal(size=(n, 3))
+    angles = rng.uniform(-np.pi, np.pi, n)
+    normals = -unit_vector(vectors) + 0.3 * rng.normal(size=(n, 3))
+    normals[np.sum(vectors * normals, axis=1) >= 0] *= -1
+    centers = rng.normal(size=(n, 3))
+    rotated = rotate(vectors, axes, angles)
+    matrices = rotation_matrix(axes, angles)
+    reflected = reflect(vectors, normals)
+    projected = project(centers, vectors, normals, np.zeros(3))
+    for i in range(n):
+        assert np.allclose(rotated[i], rotate(vectors[i], axes[i], angles[i]))
+        assert np.allclose(rotated[i], vectors[i].dot(rotation_matrix(axes[i], angles[i])))
+        assert np.allclose(matrices[i], rotation_matrix(axes[i], angles[i]))
+        assert np.allclose(reflected[i], reflect(vectors[i], normals[i]))
+        assert np.allclose(projected[i], project(centers[i], vectors[i], normals[i], np.zeros(3)))
+    print('kernels ok')
+
+    # the batch sim traces the beams of the single env
+    actions = rng.uniform(-0.9, 0.9, size=(n, IronInterfSimEnv.n_actions))
+    batch = IronInterfBatchSim(n)
+    offsets, directions = batch._trace_beams(batch._to_motor_units(actions))
+    env = IronInterfSimEnv(noise=0)
+    max_diff = 0.
+    for i in range(n):
+        env.reset_mirror_positions()
+        env.mirror1_screw_y, env.mirror1_screw_x, env.mirror2_screw_y, env.mirror2_screw_x = \
+            batch._to_motor_units(actions[i])[:4]
+        offset, direction = env._trace_beam()
+        max_diff = max(max_diff, np.abs(offset - offsets[i]).max(), np.abs(direction - directions[i]).max())
+    print('beam max diff', max_diff)
+    assert max_diff < 1e-9
@@ -0,0 +1,60 @@
+from iron_interf.envs.camera.ids_camera import _ImageHandle, total_intensity
+from iron_interf.envs.camera.camera_sim import SimImageData
+import numpy as np
+
+
+def handle_frames(image_handle, first, count, skip=()):
+    for frame_number in range(first, first + count):
+        if frame_number in skip:
+            continue
+        image = np.full((4, 6), frame_number % 256, dtype=np.uint8)
+        image_handle.handle(SimImageData(image, timestamp=0.1 * frame_number, frame_number=frame_number))
+
+
+if __name__ == '__main__':
+    # 4 frames in a ring of 6, every start slot is tried so the acquisitions wrap around the ring
+    image_handle = _ImageHandle(capacity=4, ring_size=6)
+    image_handle.add_reducer('tot_intens', total_intensity, dtype=np.uint64)
+    image_handle.add_reducer('first_pixel', lambda image: image[0, 0], dtype=np.uint8)
+    frame_number = 0
+    for _ in range(2 * image_handle.ring_size):
+        # a frame between acquisitions moves the start slot
+        handle_frames(image_handle, frame_number, 1)
+        frame_number += 1
+        image_handle.start()
+        handle_frames(image_handle, frame_number, 4)
+        assert image_handle.wait_ready(0)
+        expected = np.arange(frame_number, frame_number + 4)
+        timestamps, sequence, _, _ = image_handle.metadata()
+        assert np.array_equal(image_handle.reduced('first_pixel'), expected % 256)
+        assert np.array_equal(image_handle.reduced('tot_intens'), 24 * (expected % 256))
+        assert np.array_equal(sequence, expected) and np.allclose(timestamps, 0.1 * expected)
+        assert np.array_equal(image_handle.reduced('tot_intens', 2), 24 * (expected[:2] % 256))
+        assert image_handle.dropped_frames() == 0
+        image_handle.reset()
+        frame_number += 4
+    print('wrap around ok, write index', image_handle.write_index)
+
+    # only the last frame is kept, image() returns a copy of it
+    image = image_handle.image(0)
+    assert np.all(image == (frame_number - 1) % 256)
+    image[:] = 0
+    assert np.all(image_handle.image(0) == (frame_number - 1) % 256)
+    print('last image ok')
+
+    # a reducer added during an acquisition reads zeros for the frames already handled
+    image_handle.start()
+    handle_frames(image_handle, frame_number, 2)
+    image_handle.add_reducer('max', lambda image: image.max(), dtype=np.uint8)
+    handle_frames(image_handle, frame_number + 2, 2)
+    expected = np.arange(frame_number, frame_number + 4) % 256
+    assert np.array_equal(image_handle.reduced('max'), [0, 0] + list(expected[2:]))
+    image_handle.reset()
+    frame_number += 4
+    print('late reducer ok')
+
+    # frames the camera sent but were not handled
+    image_handle.start()
+    handle_frames(image_handle, frame_number, 6, skip=(frame_number + 1, frame_number + 2))
+    print('sequence', image_handle.metadata()[1], 'dropped', image_handle.dropped_frames())
+    assert image_handle.dropped_frames() == 2 and image_handle.dropped == 2
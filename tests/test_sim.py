@@ -0,0 +1,28 @@
+from iron_interf.envs import IronInterfEnv
+import numpy as np
+
+
+if __name__ == '__main__':
+    env = IronInterfEnv(simulated=True)
+    env.reset()
+    for _ in range(3):
+        state, reward, done, info = env.step(np.full(IronInterfEnv.n_actions, 0.1))
+        print(state.shape, reward, info['visib_device'], info['visib_camera'], info['state_calc_time'])
+
+    # films until the visibility is known within 0.2, without the photodiode read that takes one period
+    env.enable_device(False)
+    env.set_capture_tolerance(0.2)
+    state, reward, done, info = env.step(np.full(IronInterfEnv.n_actions, 0.1))
+    assert state.shape == env.observation_space.shape
+    assert info['captured_frames'] < env.n_frames
+    print(info['captured_frames'], info['visib_camera'], info['visib_capture_fit'], info['state_calc_time'])
+    env.set_capture_tolerance(None)
+    env.enable_device(True)
+
+    # photodiode only
+    env.enable_camera(False, compact_observation=True)
+    state, reward, done, info = env.step(np.full(IronInterfEnv.n_actions, 0.1))
+    assert state.shape == env.observation_space.shape
+    assert 'visib_camera' not in info
+    print(state.shape, reward, info['visib_device'], info['state_calc_time'])
+    env.close()
@@ -0,0 +1,32 @@
+from iron_interf.envs import IronInterfSimEnv
+import numpy as np
+
+
+if __name__ == '__main__':
+    env = IronInterfSimEnv()
+    env.seed(0)
+    env.reset(np.zeros(IronInterfSimEnv.n_actions))
+    print('aligned', env.info['visib_camera'], env.info['visib_device'])
+    for action_id in range(IronInterfSimEnv.n_actions):
+        actions = np.zeros(IronInterfSimEnv.n_actions)
+        actions[action_id] = 0.5
+        env.reset(actions)
+        print(action_id, env.info['visib_camera'], env.info['visib_device'])
+
+    # visibility fitted from the frames only
+    env.enable_device(False)
+    env.reset(np.zeros(IronInterfSimEnv.n_actions))
+    print('fit', env.info['visib_camera'], env.info['visib_fit'], env.info['fringe_phase'])
+
+    # contrast, phase and intensity maps instead of the frames
+    env.set_observation_mode('contrast')
+    state = env.reset(np.zeros(IronInterfSimEnv.n_actions))
+    assert env.observation_space.contains(state)
+    print('contrast', state.shape, state[0].mean())
+
+    # coarse levels of the same capture
+    env = IronInterfSimEnv(n_points=64, n_frames=8, pyramid=(16, 32))
+    env.set_observation_points(16)
+    state = env.reset(np.zeros(IronInterfSimEnv.n_actions))
+    assert env.observation_space.contains(state)
+    print('pyramid', state.shape, {points: frames.shape for points, frames in env.info['pyramid'].items()})
@@ -0,0 +1,20 @@
+from iron_interf.envs import IronInterfEnv
+import numpy as np
+
+
+if __name__ == '__main__':
+    step_times = {}
+    for sync in ('wait', 'predict'):
+        env = IronInterfEnv(simulated=True, sync=sync)
+        env.reset()
+        times, visibs = [], []
+        for _ in range(4):
+            state, reward, done, info = env.step(np.zeros(IronInterfEnv.n_actions))
+            times.append(info['state_calc_time'])
+            visibs.append((info['visib_camera'], info['visib_device']))
+        env.close()
+        step_times[sync] = np.mean(times[1:])
+        print(sync, 'state calc time', step_times[sync], 'visib camera, device', np.mean(visibs, axis=0))
+
+    # predict films right away and reads the photodiode period it filmed
+    assert step_times['predict'] < step_times['wait']
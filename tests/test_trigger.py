@@ -0,0 +1,61 @@
+from iron_interf.envs.camera.trigger import parse_lines, _parse_lines_per_line, parse_frames, PeakDetector, \
+    FRAME_SYNC, FRAME_DTYPE
+import numpy as np
+
+
+def random_lines(rng, n_lines, corrupt=0.):
+    lines = []
+    for generator, detector in rng.integers(0, 1024, size=(n_lines, 2)):
+        line = '{},{}\r\n'.format(generator, detector).encode()
+        if rng.random() < corrupt:
+            # drop, repeat or garble a byte as a noisy serial line does
+            i = rng.integers(len(line))
+            line = line[:i] + bytes([rng.choice([ord('x'), ord(','), ord('-'), 0xff, line[i]])]) + line[i + 1:]
+        lines.append(line)
+    return b''.join(lines)
+
+
+def binary_frames(samples):
+    frames = np.zeros(len(samples), dtype=FRAME_DTYPE)
+    frames['sync'] = FRAME_SYNC
+    frames['generator'], frames['detector'] = samples[:, 0], samples[:, 1]
+    return frames.tobytes()
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+
+    # the vectorized text parser gives the same samples as the per line parser
+    for corrupt in (0., 0.01, 0.1, 0.5):
+        mismatches = 0
+        for _ in range(200):
+            lines = random_lines(rng, rng.integers(1, 300), corrupt)
+            expected = _parse_lines_per_line(lines)
+            samples = parse_lines(lines)
+            mismatches += samples.shape != expected.shape or not np.array_equal(samples, expected)
+        print('text corrupt', corrupt, 'mismatches', mismatches)
+        assert mismatches == 0
+
+    # binary frames are resynchronized after corrupted bytes and split across chunks
+    samples = rng.integers(0, 1024, size=(500, 2)).astype(np.float64)
+    stream = binary_frames(samples[:200]) + b'\x13\xa5' + binary_frames(samples[200:])
+    parsed, rest = [], b''
+    for begin in range(0, len(stream), 97):
+        chunk_samples, rest = parse_frames(rest + stream[begin: begin + 97])
+        parsed.append(chunk_samples)
+    parsed = np.concatenate(parsed)
+    print('binary', parsed.shape, 'rest', len(rest))
+    assert np.array_equal(parsed, samples) and rest == b''
+
+    # maxima of a chunked stream are the maxima of the whole stream
+    t = np.arange(3600) / 360.
+    generator = np.round(500 + 400 * np.cos(2 * np.pi * t))
+    _, expected = PeakDetector(4).process(generator, 720)
+    detector, maxima = PeakDetector(4), []
+    for begin in range(0, len(generator), 37):
+        _, chunk_maxima = detector.process(generator[begin: begin + 37], 720)
+        maxima.extend((begin + chunk_maxima).tolist())
+    print('maxima', maxima)
+    assert np.array_equal(maxima, expected)
+    # one max per period, a few samples after the generator max
+    assert len(maxima) == 10 and np.all((np.mod(maxima, 360) < 20) | (np.mod(maxima, 360) > 340))
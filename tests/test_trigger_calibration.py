@@ -0,0 +1,63 @@
+from iron_interf.envs.camera.trigger import CameraTrigger
+from iron_interf.envs.camera.camera_sim import SimModulation, SimSerialPortReader
+import json
+import os
+import tempfile
+import time
+
+
+def sim_trigger(modulation, path):
+    return CameraTrigger(reader=SimSerialPortReader(modulation), calibration_path=path,
+                         calibration_time=2 * modulation.period)
+
+
+def save_calibration(path, max_value, age):
+    with open(path, 'w') as f:
+        json.dump({'max_value': max_value, 'time': time.time() - age}, f)
+
+
+if __name__ == '__main__':
+    # the simulated generator max is 900
+    modulation = SimModulation()
+    path = os.path.join(tempfile.mkdtemp(), 'trigger_calibration.json')
+
+    # no cache, the trigger calibrates and saves
+    trigger = sim_trigger(modulation, path)
+    trigger.init()
+    trigger.close()
+    with open(path) as f:
+        saved = json.load(f)
+    print('saved', saved)
+    assert abs(saved['max_value'] - 900) < 10 and saved['time'] == trigger.calibrated_at
+
+    # a fresh cache that matches the stream is loaded, close keeps its time
+    save_calibration(path, 895., age=60)
+    cached_time = json.load(open(path))['time']
+    trigger = sim_trigger(modulation, path)
+    trigger.init()
+    trigger.close()
+    print('loaded', trigger.max_value)
+    assert trigger.max_value == 895. and json.load(open(path))['time'] == cached_time
+
+    # an expired cache is calibrated again
+    save_calibration(path, 895., age=2 * 24 * 3600)
+    trigger = sim_trigger(modulation, path)
+    trigger.init()
+    print('expired', trigger.max_value)
+    assert trigger.calibrated_at > cached_time and trigger.max_value != 895.
+    trigger.close()
+
+    # a fresh cache of another generator amplitude is calibrated again
+    save_calibration(path, 1400., age=60)
+    trigger = sim_trigger(modulation, path)
+    trigger.init()
+    print('mismatch', trigger.max_value, trigger.threshold)
+    assert abs(trigger.max_value - 900) < 10
+
+    # a threshold above the generator max falls back to a calibration instead of waiting forever
+    trigger._set_max_value(1400.)
+    begin = time.time()
+    index = trigger.wait_for_generator_max()
+    print('fallback max at', index, 'after', time.time() - begin, 's, max_value', trigger.max_value)
+    assert index is not None and abs(trigger.max_value - 900) < 10
+    trigger.close()
@@ -0,0 +1,66 @@
+from iron_interf.envs.visibility import estimators, frame_estimators, modulation_phases
+import numpy as np
+
+
+def sinusoid(visibility, fringe_phase, n_samples, background=400., dark=50.):
+    """
+    photodiode signal of fringes of known visibility, sampled over one modulation period
+    """
+    return dark + background * (1 + visibility * np.cos(modulation_phases(n_samples) + fringe_phase))
+
+
+# largest error of every estimator on noise free and on noisy signals, the extrema estimators
+# do not sample the exact fringe extrema, the fourier one low passes them, noise widens min_max
+tolerances = {
+    'min_max': (0.005, 0.05),
+    'trimmed_extrema': (0.02, 0.03),
+    'sinusoid_fit': (1e-9, 0.015),
+    'fourier': (0.03, 0.04),
+}
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    n_samples, dark, noise = 64, 50., 5.
+    visibilities = np.array([0.1, 0.3, 0.5, 0.7, 0.9])
+    fringe_phases = rng.uniform(-np.pi, np.pi, 16)
+    # (visibilities, fringe phases, samples), the estimators take any batch axes
+    signals = sinusoid(visibilities[:, np.newaxis, np.newaxis], fringe_phases[:, np.newaxis], n_samples, dark=dark)
+    noisy = signals + noise * rng.normal(size=signals.shape)
+    expected = np.broadcast_to(visibilities[:, np.newaxis], signals.shape[:-1])
+
+    for name, estimator in estimators.items():
+        clean_tolerance, noisy_tolerance = tolerances[name]
+        clean_error = np.abs(estimator(signals, dark=dark) - expected).max()
+        noisy_error = np.abs(estimator(noisy, dark=dark) - expected).max()
+        print('{}: error {:.2e} noise free, {:.2e} noisy'.format(name, clean_error, noisy_error))
+        assert clean_error < clean_tolerance and noisy_error < noisy_tolerance, name
+        # the dark offset ignored, it passes for background and lowers the visibility
+        undarkened = estimator(signals)
+        assert np.all(undarkened < expected), name
+        assert np.abs(undarkened - expected * 400. / (400. + dark)).max() < clean_tolerance, name
+        # the 1d signal of the batch
+        assert np.isclose(estimator(signals[2, 3], dark=dark), estimator(signals, dark=dark)[2, 3]), name
+    print('signal estimators ok')
+
+    # frames of pixels with a gaussian background and one visibility, (n_frames, h, w)
+    h, w = 12, 16
+    y, x = np.mgrid[:h, :w]
+    envelope = 200. * np.exp(-((y - h / 2) ** 2 + (x - w / 2) ** 2) / 40.)
+    for visibility in visibilities:
+        pixel_phases = 0.4 * x + rng.uniform(-np.pi, np.pi)
+        frames = dark + envelope * (1 + visibility * np.cos(
+            modulation_phases(n_samples)[:, np.newaxis, np.newaxis] + pixel_phases))
+        noisy_frames = np.clip(np.round(frames + noise * rng.normal(size=frames.shape)), 0, 255).astype(np.uint8)
+        for name, estimator in frame_estimators.items():
+            clean_error = abs(estimator(frames, dark=dark) - visibility)
+            noisy_error = abs(estimator(noisy_frames, dark=dark) - visibility)
+            print('{} visibility {}: error {:.2e} noise free, {:.2e} noisy'.format(
+                name, visibility, clean_error, noisy_error))
+            # the max - min of every pixel picks up the noise, most in the dim pixels
+            assert clean_error < 0.01 and noisy_error < 0.1, name
+            assert estimator(noisy_frames, dark=dark) > visibility, name
+            assert estimator(frames) < visibility, name
+            # a batch of stacks
+            assert np.allclose(estimator(np.stack([frames, frames]), dark=dark), estimator(frames, dark=dark)), name
+    print('frame estimators ok')